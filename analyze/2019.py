@@ -6,6 +6,7 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 sns.set(color_codes=True)
 import os
+from profiles import TeamProfiles
 
 # Const
 cargo_color = "#F9651D"
@@ -25,22 +26,9 @@ list(data)
 #teams = pd.read_csv("../data/TeamInfo.csv")
 
 #%%
-# Stratify data by teams
-data_team = {}
-for i, row in data.iterrows():
-    team = row.Team
-
-    try:
-        data_team[team].append(row)
-    except KeyError:
-        data_team[team] = []
-        data_team[team].append(row)
-#%%
-# Convert team records to dataframes
-#for t in data_team:
-#    data_team[t] = pd.DataFrame(data_team[t])
-
-data_team = {t: pd.DataFrame(data_team[t]) for t in data_team}
+# Profile every team's scoring by week and event
+profiles = TeamProfiles.build(data)
+profiles.table('week', 'mean').head()
 
 #%%
 team = '236'
@@ -51,7 +39,8 @@ shade = False
 lim = 20
 w_ovr = 0.58
 
-team_dist = data.loc[(data.Team == team) & (data.Week == week), :]
+team_dist = profiles.samples(team, week=week)
+team_stats = profiles.lookup(team, week=week)
 ovr_dist = data.loc[(data["Robot Number"] == 1) & (data.Week == week), :]
 
 sns.kdeplot(team_dist["cargoScored"], shade=shade, color=cargo_color, ax=ax1)
@@ -60,8 +49,8 @@ sns.kdeplot(team_dist["panelsScored"], shade=shade, color=panel_color, ax=ax1)
 sns.kdeplot(ovr_dist['cargoScored'], shade=shade, color=cargo_color, ax=ax2, bw=w_ovr)
 sns.kdeplot(ovr_dist['panelsScored'], shade=shade, color=panel_color, ax=ax2, bw=w_ovr)
 
-ax1.axvline(team_dist["cargoScored"].mean(), color=cargo_color, linestyle='dashed')
-ax1.axvline(team_dist["panelsScored"].mean(), color=panel_color, linestyle='dashed')
+ax1.axvline(team_stats.loc["mean", "cargoScored"], color=cargo_color, linestyle='dashed')
+ax1.axvline(team_stats.loc["mean", "panelsScored"], color=panel_color, linestyle='dashed')
 
 ax2.axvline(ovr_dist['cargoScored'].mean(), color=cargo_color, linestyle='dashed')
 ax2.axvline(ovr_dist['panelsScored'].mean(), color=panel_color, linestyle='dashed')
@@ -73,8 +62,8 @@ ax1.set_xlim(right=lim)
 ax2.set_xlim(right=lim)
 
 ax1.legend(["Cargo Scored", "Panels Scored",
-    "Mean Panels: {}".format(round(team_dist["cargoScored"].mean(),2)),
-    "Mean Cargo: {}".format(round(team_dist["panelsScored"].mean(),2))]
+    "Mean Panels: {}".format(round(team_stats.loc["mean", "cargoScored"],2)),
+    "Mean Cargo: {}".format(round(team_stats.loc["mean", "panelsScored"],2))]
 )
 ax2.legend(["Cargo Scored", "Panels Scored",
     "Mean Panels: {}".format(round(ovr_dist["cargoScored"].mean(),2)),
@@ -85,23 +74,11 @@ fig.show()
 
 #%%
 team = "236"
-def getTeamData(team, filt=lambda df: df):
-    df = filt(data_team[team])
-    return {
-        "Team": team, 
-        "avgCargo": df.cargoScored.mean(), 
-        "avgPanels": df.panelsScored.mean()
-    }
-
-f = lambda df: df.loc[df.Week > 3,:]
-
-teamdata_l = [getTeamData(t,f) for t in data_team]
-
-teamdata = pd.DataFrame(teamdata_l)
+late_weeks = np.unique(data.Week[data.Week > 3])
+teamdata = profiles.summary(late_weeks).rename(columns={ "cargoScored": "avgCargo", "panelsScored": "avgPanels" })
 
-df = data_team[team]
-t_cargo = df.loc[df.Week==6,"cargoScored"].mean()
-t_panels = df.loc[df.Week==6,"panelsScored"].mean()
+t_cargo = profiles.lookup(team, week=6).loc["mean", "cargoScored"]
+t_panels = profiles.lookup(team, week=6).loc["mean", "panelsScored"]
 
 fig, ax = plt.subplots(1,1, figsize=(8,5))
 sns.kdeplot(teamdata.avgCargo, ax=ax, color=cargo_color)
@@ -124,4 +101,4 @@ print("Tail for cargo: {}".format(len(better_cargo)))
 print("Tail for panels: {}".format(len(better_panels)))
 
 #%%
-print(len(data_team))
+print(len(profiles.teams))
@@ -8,24 +8,14 @@ import pandas as pd
 # %%
 targets = ['teleopCellsInner','teleopCellsOuter','teleopCellsBottom', 'autoCellPoints', 'rp']
 
-matchdata = pd.read_csv("../data/2020_MatchData.csv", index_col=[0,12])
-matchdata_ol = pd.read_csv("../data/2020_MatchData_ol.csv", index_col=0)
+matchdata = pd.read_csv("../data/2020_MatchData.csv")
+matchdata_ol = pd.read_csv("../data/2020_MatchData_ol.csv")
 
 teams, team_data = OPRModel.load(matchdata_ol.copy())
-matchdata = matchdata.loc[matchdata["Robot Number"]==1,targets]
-
-table = matchdata.merge(team_data['teams'], how='left', left_index=True, right_index=True)
-table.head()
 
 # %%
 model = OPRModel()
-y = table.drop('teams',axis=1).to_numpy()
-y_names = table.drop('teams',axis=1).columns
-y_names = {i:n for i,n in enumerate(y_names)}
-
-model.train(table, y)
-model.table.rename(columns=y_names,inplace=True)
-results = model.table.copy()
+results = model.train_components(team_data, matchdata, fields=targets)
 results.head(10)
 
 # %%
@@ -103,4 +103,29 @@ plt.show()
 # qualified events like championships, but it's hard to say for sure.
 # Regardless, we'll have to find a different distribution.
 
+# %% [markdown]
+# Rather than pick a distribution, we can use the empirical one. What turns a
+# predicted margin into a win probability is how far the actual margins land
+# from the predictions, so we tabulate the distribution of the OPR prediction
+# errors for every week and competition level (smoothed with a kernel density
+# estimate). Each match is predicted from the OPRs of the matches before it at
+# its event.
+
 # %%
+from margins import MarginDistributions
+from models import OPRModel
+from oprvalidation import next_match_predictions
+
+onelines = pd.read_csv(f"../data/{YEAR}_MatchData_ol.csv")
+_, event_data = OPRModel.load(onelines)
+scores = pd.Series(next_match_predictions(event_data), index=event_data.index).unstack('Alliance')
+predicted_margin = (scores.blue - scores.red).reindex(onelines.index)
+margin_tables = MarginDistributions.from_matchdata(onelines, predicted=predicted_margin)
+
+predicted = np.linspace(-100, 100, 201)
+plt.plot(predicted, margin_tables.win_probability(predicted, YEAR, 1, 'qm'), label="Week 1 quals")
+plt.plot(predicted, margin_tables.win_probability(predicted, YEAR, 1, 'f'), label="Week 1 finals")
+plt.title("Win Probability from Margin")
+plt.xlabel("Predicted Margin")
+plt.legend()
+plt.show()
@@ -0,0 +1,136 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import storage
+import os
+
+
+class DivisionIndex:
+    """
+    Every team's championship division in every year.
+
+    Built once from the TeamDivisions files, as a year x team matrix of int8
+    division codes over the registry of every team that appears in them.
+    Code 0 means the team was registered that year but had no division, and
+    -1 that it wasn't registered (or there's no file for the year). Queries
+    over any set of teams are column slices of the matrix.
+    """
+
+    DIVISIONS = ['carv', 'gal', 'hop', 'new', 'roe', 'tur', 'arc', 'cars', 'cur', 'tes', 'dal', 'dar']
+    NONE = 0
+    MISSING = -1
+
+    def __init__(self, years, teams, codes, divisions=DIVISIONS):
+        self.years = np.asarray(years)
+        self.teams = np.asarray(teams)
+        self._index = pd.Index(self.teams)
+        self.codes = np.asarray(codes, dtype=np.int8)
+        self.divisions = list(divisions)
+        self._co_assignment = None
+
+
+    @classmethod
+    def build(cls, tables:dict, divisions=DIVISIONS):
+        """ Index a dict of TeamDivisions frames keyed by year """
+        years = sorted(tables)
+        teams = np.unique(np.concatenate([tables[y].Team.to_numpy() for y in years])) if years else np.zeros(0, int)
+
+        # division names to codes 1..D, anything else (e.g. NA) to 0
+        lookup = { d: i + 1 for i, d in enumerate(divisions) }
+        codes = np.full((len(years), len(teams)), cls.MISSING, dtype=np.int8)
+        for i, y in enumerate(years):
+            table = tables[y]
+            codes[i, np.searchsorted(teams, table.Team.to_numpy())] = \
+                table.Division.map(lookup).fillna(cls.NONE).to_numpy(dtype=np.int8)
+
+        return cls(years, teams, codes, divisions)
+
+
+    @classmethod
+    def from_files(cls, years, data_dir="../data"):
+        """ Index the TeamDivisions files of a range of years, skipping any that are missing """
+        tables = {}
+        for y in years:
+            filename = os.path.join(data_dir, f"{y}_TeamDivisions.csv")
+            if os.path.exists(filename):
+                tables[y] = pd.read_csv(filename, index_col=False)
+        return cls.build(tables)
+
+
+    def columns(self, teams) -> np.ndarray:
+        """ Get the column of each team in the code matrix """
+        return storage.team_positions(self._index, teams)
+
+
+    def table(self, teams) -> pd.DataFrame:
+        """ Get the division name of each of the given teams in each year """
+        names = np.array(['', 'NA'] + self.divisions, dtype=object)
+        codes = self.codes[:, self.columns(list(teams))]
+        output = pd.DataFrame(names[codes.astype(np.int64) + 1], index=pd.Index(self.years, name='Year'),
+            columns=list(teams))
+        return output.replace('', np.nan)
+
+
+    def shared_years(self, teams) -> np.ndarray:
+        """ Get the years in which all of the given teams were in the same division """
+        codes = self.codes[:, self.columns(list(teams))]
+        shared = (codes[:, :1] > self.NONE) & (codes == codes[:, :1]).all(axis=1, keepdims=True)
+        return self.years[shared.ravel()]
+
+
+    def _assignments(self, divisions=True) -> sp.csr_matrix:
+        """
+        Get a sparse team x (year, division) indicator of every assignment,
+        or of every year a team had a division at all.
+        """
+        year, team = np.nonzero(self.codes > self.NONE)
+        group = year * (len(self.divisions) + 1) + self.codes[year, team] if divisions else year
+        return sp.csr_matrix((np.ones(len(team), dtype=np.int32), (team, group)),
+            shape=(len(self.teams), len(self.years) * (len(self.divisions) + 1)))
+
+
+    def co_assignment(self, frequency=False) -> sp.csr_matrix:
+        """
+        Count the years every pair of teams was put in the same division, as
+        a sparse team x team matrix. With frequency=True, divide by the number
+        of years both teams had a division at all.
+        """
+        if self._co_assignment is None:
+            B = self._assignments()
+            counts = B @ B.T
+            self._co_assignment = (counts - sp.diags(counts.diagonal())).tocsr().astype(np.int32)
+            self._co_assignment.eliminate_zeros()
+
+        counts = self._co_assignment
+        if not frequency:
+            return counts
+
+        # every shared division is also a year both had one, so only stored entries divide
+        B = self._assignments(divisions=False)
+        both = (B @ B.T).tocsr()
+        return counts.multiply(both.power(-1.0)).tocsr()
+
+
+    def pair_counts(self, a, b) -> pd.DataFrame:
+        """ Count the years paired arrays of teams shared a division, and the years both had one """
+        i, j = self.columns(np.atleast_1d(a)), self.columns(np.atleast_1d(b))
+        ci, cj = self.codes[:, i], self.codes[:, j]
+        return pd.DataFrame({
+            'team': np.atleast_1d(a),
+            'other': np.atleast_1d(b),
+            'shared': ((ci == cj) & (ci > self.NONE)).sum(axis=0),
+            'both': ((ci > self.NONE) & (cj > self.NONE)).sum(axis=0),
+        })
+
+
+    def save(self, path):
+        """ Write the index to a directory of .npy files """
+        storage.save_arrays(path, { 'years': self.years, 'teams': self.teams, 'codes': self.codes },
+            { 'divisions': self.divisions })
+
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        """ Load an index saved with `save` """
+        arrays, meta = storage.load_arrays(path, mmap_mode)
+        return cls(arrays['years'], arrays['teams'], arrays['codes'], meta['divisions'])
@@ -1,17 +1,13 @@
-import pandas as pd
-import numpy as np
+from divisionindex import DivisionIndex
 
 teams = [254, 118, 148]
 #teams = [236,1124]
 
-year = 2019
-for year in range(2007, 2019):
-    file = f"C:/Users/Sam/Documents/236/Statistics/data/{year}_TeamDivisions.csv"
-    data = pd.read_csv(file, index_col=False)
+index = DivisionIndex.from_files(range(2007, 2019), "C:/Users/Sam/Documents/236/Statistics/data")
 
-    divisions = [data.loc[data.Team==team, 'Division'].values[0] for team in teams]
-
-    print(f"{year}: {set(divisions)}")
+divisions = index.table(teams)
+for year, row in divisions.iterrows():
+    print(f"{year}: {set(row)}")
 
+print(f"Shared a division in: {index.shared_years(teams)}")
 print("Done")
-    
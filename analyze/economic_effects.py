@@ -4,26 +4,31 @@ import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 sns.set()
+import geo
 
 FNAME_RATINGS = "Analytics/data/2019_end_ratings.csv"
 FNAME_METRIC = "data/ACS_17_5YR_S1903.csv"
 FNAME_DETAILS = "data/TeamZips.csv"
+FNAME_INFO = "data/TeamInfo.csv"
 
 ratings = pd.read_csv(FNAME_RATINGS).drop(["mu","sigma"], axis=1)
-details = pd.read_csv(FNAME_DETAILS).drop(['City', 'State', 'Country'], axis=1)
+details = geo.team_table(FNAME_DETAILS, FNAME_METRIC, FNAME_INFO, cache="data/TeamDemographics.csv")
 
-income = pd.read_csv(FNAME_METRIC).loc[:,['GEO.id2','HC03_EST_VC02']].astype({"GEO.id2": "object"})
-income.rename(columns={"GEO.id2": "ZIP", "HC03_EST_VC02": "income"}, inplace=True)
-income.ZIP = income.ZIP.map(lambda s: (5-len(str(s))) * "0" + str(s))
+print(details.head())
 
-print(income.head())
-
-combined = ratings.merge(details, how="left", on="Team")
-
-combined = combined.merge(income, left_on="Zip", right_on="ZIP")
+combined = ratings.join(details, on="Team", how="inner")
 
 plot = plt.scatter(combined.income, combined.Score)
 plt.savefig("Analytics/compiled/figure.png")
 
 
 # %%
+# Average rating of the teams within 50 km of each team
+locations = geo.TeamLocations(details)
+nearby = locations.neighbourhood_mean(ratings.set_index("Team").Score, km=50)
+
+combined = combined.join(nearby, on="Team")
+plt.scatter(combined["mean"], combined.Score)
+plt.xlabel("Mean Rating Within 50 km")
+plt.ylabel("Rating")
+plt.show()
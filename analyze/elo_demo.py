@@ -5,6 +5,7 @@
 # Import libraries
 import models
 from models import EloModel
+from history import RatingHistory
 import pandas as pd
 import time
 import matplotlib.pyplot as plt
@@ -15,25 +16,23 @@ import seaborn as sns
 years = range(2005, 2020)
 teams = models.get_teams(years)
 
-model = EloModel(teams, k=30, n=400, i=1000, logging=True)
+model = EloModel(teams, k=30, n=400, i=1000, logging=True, history=True)
 
 print(f"Training on {','.join(map(str,years))}")
 print('='*35)
 start = time.time()
-winners = []
 
 for year in years:
     filename = f"../data/{year}_MatchData_ol.csv"
     data = pd.read_csv(filename)
     data = models.process_data(data)
     data = models.sort_data(data)
-    winners.append(data.winner)
 
     print(f"Year: {year}")
     print(f"Simulating {len(data)} matches")
     substart = time.time()
 
-    data.apply(model.train, axis=1)
+    model.train_many(data)
 
     print(f"Training time: {int(time.time() - substart)} s")
     print("="*35)
@@ -41,9 +40,15 @@ for year in years:
     model.export(f"data/{year}_end_elos_k30.csv")
 
 print(f"Training Time: {int(time.time() - start)} s")
-print(f"Brier score: {model.test(pd.concat(winners))}")
+print(f"Brier score: {model.test()}")
 
 
+#%%
+# Ratings going into any week are kept as snapshots, so we don't need to retrain
+print(f"1678 going into week 4 of 2018: {model.as_of(1678, 2018, 4):.1f}")
+print(f"1678 at the end of 2018: {model.as_of(1678, 2018, RatingHistory.CLOSE):.1f}")
+model.history.save("data/elo_history")
+
 #%%
 sns.kdeplot(model.table.Rating, shade=True)
 plt.show()
@@ -72,7 +77,7 @@ data.apply(trained.train, axis=1)
 print(f"Training time: {int(time.time() - substart)} s")
 print("="*35)
 
-print(f"Brier: {trained.test(data.winner)}")
+print(f"Brier: {trained.test()}")
 
 
 #%%
@@ -0,0 +1,245 @@
+import numpy as np
+import pandas as pd
+
+
+class Evaluator:
+    """
+    Streaming accuracy metrics for match predictions.
+
+    Attach one to a model during training and it will accumulate the Brier
+    score, log loss, accuracy and calibration of every prediction, broken down
+    by year, week and competition level. All of the running totals live in
+    arrays allocated up front, so nothing grows with the number of matches
+    unless per-match predictions are kept. The year and week axes grow if a
+    prediction falls outside them (e.g. a later season, or an offseason
+    event in week 22).
+    """
+
+    LEVELS = ['qm', 'qf', 'sf', 'f']
+    TOTALS = ['n', 'decided', 'correct', 'brier_sum', 'logloss_sum', 'bin_n', 'bin_p', 'bin_o']
+    OUTCOMES = { 'blue': 1.0, 'red': 0.0, 'tie': 0.5 }
+    EPS = 1e-15
+
+    def __init__(self, years=range(2001, 2021), weeks=16, bins=10, keep_predictions=False):
+        self.years = list(years)
+        self.weeks = weeks
+        self.bins = bins
+        self.keep_predictions = keep_predictions
+
+        self._year = { y:i for i,y in enumerate(self.years) }
+        self._level = { l:i for i,l in enumerate(self.LEVELS) }
+
+        shape = (len(self.years), weeks, len(self.LEVELS))
+        self.n = np.zeros(shape, dtype=np.int64)
+        self.decided = np.zeros(shape, dtype=np.int64)
+        self.correct = np.zeros(shape)
+        self.brier_sum = np.zeros(shape)
+        self.logloss_sum = np.zeros(shape)
+
+        self.bin_n = np.zeros(shape + (bins,), dtype=np.int64)
+        self.bin_p = np.zeros(shape + (bins,))
+        self.bin_o = np.zeros(shape + (bins,))
+
+        self._size = 0
+        if keep_predictions:
+            self._allocate(1024)
+
+
+    def _allocate(self, capacity):
+        """ Grow the per-match prediction columns to hold `capacity` rows """
+        columns = {
+            'key': np.empty(capacity, dtype=object),
+            'year': np.zeros(capacity, dtype=np.int16),
+            'week': np.zeros(capacity, dtype=np.int8),
+            'level': np.zeros(capacity, dtype=np.int8),
+            'prediction': np.zeros(capacity, dtype=np.float64),
+            'outcome': np.zeros(capacity, dtype=np.float32),
+        }
+        if self._size:
+            for name, column in columns.items():
+                column[:self._size] = self.predictions[name][:self._size]
+        self.predictions = columns
+
+
+    def _grow(self, year, week):
+        """ Grow the year and week axes of the running totals to cover a week """
+        years = self.years if year in self._year else sorted(self.years + [year])
+        weeks = max(self.weeks, week + 1)
+
+        rows = [years.index(y) for y in self.years]
+        for name in self.TOTALS:
+            old = getattr(self, name)
+            new = np.zeros((len(years), weeks) + old.shape[2:], dtype=old.dtype)
+            new[rows, :self.weeks] = old
+            setattr(self, name, new)
+
+        self.years, self.weeks = years, weeks
+        self._year = { y:i for i,y in enumerate(self.years) }
+
+
+    def update(self, year, week, comp_level, p, winner, key=None):
+        """ Score a single prediction that blue wins against the real winner """
+        year, week = int(year), int(week)
+        if year not in self._year or week >= self.weeks:
+            self._grow(year, week)
+
+        cell = (self._year[year], week, self._level[comp_level])
+        o = self.OUTCOMES[winner]
+
+        self.n[cell] += 1
+        self.brier_sum[cell] += (p - o)**2
+
+        q = min(max(p, self.EPS), 1 - self.EPS)
+        self.logloss_sum[cell] -= o * np.log(q) + (1 - o) * np.log(1 - q)
+
+        if o != 0.5:
+            self.decided[cell] += 1
+            # an even forecast picks no one, and counts as half right
+            self.correct[cell] += 0.5 if p == 0.5 else (p > 0.5) == (o == 1.0)
+
+        b = min(int(p * self.bins), self.bins - 1)
+        self.bin_n[cell + (b,)] += 1
+        self.bin_p[cell + (b,)] += p
+        self.bin_o[cell + (b,)] += o
+
+        if self.keep_predictions:
+            if self._size == len(self.predictions['key']):
+                self._allocate(2 * self._size)
+            i = self._size
+            self.predictions['key'][i] = key
+            self.predictions['year'][i] = year
+            self.predictions['week'][i] = week
+            self.predictions['level'][i] = cell[2]
+            self.predictions['prediction'][i] = p
+            self.predictions['outcome'][i] = o
+            self._size += 1
+
+
+    def update_many(self, year, week, comp_level, p, winner, key=None):
+        """ Score a batch of predictions from a single week """
+        p = np.asarray(p, dtype=np.float64)
+        o = pd.Series(winner).map(self.OUTCOMES).to_numpy(dtype=np.float64)
+        levels = pd.Series(comp_level).map(self._level).to_numpy(dtype=np.int64)
+
+        year, week = int(year), int(week)
+        if year not in self._year or week >= self.weeks:
+            self._grow(year, week)
+        cell = (self._year[year], week, levels)
+
+        q = np.clip(p, self.EPS, 1 - self.EPS)
+        decided = o != 0.5
+
+        np.add.at(self.n, cell, 1)
+        np.add.at(self.brier_sum, cell, (p - o)**2)
+        np.add.at(self.logloss_sum, cell, -(o * np.log(q) + (1 - o) * np.log(1 - q)))
+        np.add.at(self.decided, cell, decided)
+        np.add.at(self.correct, cell, decided * np.where(p == 0.5, 0.5, (p > 0.5) == (o == 1.0)))
+
+        b = np.minimum((p * self.bins).astype(np.int64), self.bins - 1)
+        np.add.at(self.bin_n, cell + (b,), 1)
+        np.add.at(self.bin_p, cell + (b,), p)
+        np.add.at(self.bin_o, cell + (b,), o)
+
+        if self.keep_predictions:
+            capacity = len(self.predictions['key'])
+            while self._size + len(p) > capacity:
+                capacity *= 2
+            if capacity > len(self.predictions['key']):
+                self._allocate(capacity)
+            i = slice(self._size, self._size + len(p))
+            self.predictions['key'][i] = key
+            self.predictions['year'][i] = year
+            self.predictions['week'][i] = week
+            self.predictions['level'][i] = levels
+            self.predictions['prediction'][i] = p
+            self.predictions['outcome'][i] = o
+            self._size += len(p)
+
+
+    def observe(self, row, p):
+        """ Score a prediction for a processed match record """
+        self.update(row.Year, row.Week, row.comp_level, p, row.winner, row.Key)
+
+
+    def brier(self) -> float:
+        """ Get the overall Brier score of every prediction seen so far """
+        return self.brier_sum.sum() / self.n.sum()
+
+
+    def summary(self, by=('year',)) -> pd.DataFrame:
+        """
+        Get Brier score, log loss and accuracy grouped by any combination of
+        'year', 'week' and 'level'.
+        """
+        axes = ['year', 'week', 'level']
+        drop = tuple(i for i,a in enumerate(axes) if a not in by)
+
+        sums = { name: getattr(self, name).sum(axis=drop) for name in self.TOTALS[:5] }
+
+        labels = {
+            'year': self.years,
+            'week': list(range(self.weeks)),
+            'level': self.LEVELS
+        }
+        index = pd.MultiIndex.from_product([labels[a] for a in axes if a in by],
+            names=[a for a in axes if a in by])
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            table = pd.DataFrame({
+                'n': sums['n'].ravel(),
+                'brier': (sums['brier_sum'] / sums['n']).ravel(),
+                'logloss': (sums['logloss_sum'] / sums['n']).ravel(),
+                'accuracy': (sums['correct'] / sums['decided']).ravel(),
+            }, index=index)
+
+        return table.loc[table.n > 0, :]
+
+
+    def calibration(self) -> pd.DataFrame:
+        """ Get the mean prediction and observed outcome for each probability bin """
+        n = self.bin_n.sum(axis=(0,1,2))
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            table = pd.DataFrame({
+                'n': n,
+                'predicted': self.bin_p.sum(axis=(0,1,2)) / n,
+                'observed': self.bin_o.sum(axis=(0,1,2)) / n,
+            }, index=pd.Index(np.arange(self.bins) / self.bins, name='bin'))
+
+        return table
+
+
+    def save_predictions(self, filename):
+        """ Write the kept per-match predictions to a typed columnar .npz file """
+        columns = { name: column[:self._size] for name, column in self.predictions.items() }
+        columns['key'] = columns['key'].astype(str)
+        np.savez(filename, **columns)
+
+
+    def save(self, filename):
+        """ Save the running totals (and any kept predictions) to an .npz file """
+        arrays = { name: getattr(self, name) for name in self.TOTALS }
+        if self.keep_predictions:
+            arrays.update({ f"prediction_{name}": column[:self._size] for name, column in self.predictions.items() })
+            arrays['prediction_key'] = arrays['prediction_key'].astype(str)
+
+        np.savez(filename, years=np.array(self.years), weeks=self.weeks, bins=self.bins, **arrays)
+
+
+    @classmethod
+    def load(cls, filename):
+        """ Load an evaluator saved with `save` so it can keep accumulating """
+        with np.load(filename, allow_pickle=False) as f:
+            keep = 'prediction_key' in f.files
+            evaluator = cls([int(y) for y in f['years']], int(f['weeks']), int(f['bins']), keep_predictions=keep)
+            for name in cls.TOTALS:
+                setattr(evaluator, name, f[name].astype(getattr(evaluator, name).dtype))
+
+            if keep:
+                size = len(f['prediction_key'])
+                evaluator._allocate(max(size, 1024))
+                for name in evaluator.predictions:
+                    evaluator.predictions[name][:size] = f[f"prediction_{name}"]
+                evaluator._size = size
+
+        return evaluator
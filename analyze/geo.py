@@ -0,0 +1,143 @@
+"""
+Team locations and demographics.
+
+Joins the team ZIP codes from TeamZips.csv with census income by ZIP and the
+coordinates from TeamInfo.csv into one cached table, and indexes team
+coordinates with a KD-tree for radius and nearest neighbour queries.
+
+Coordinates are placed on the unit sphere before they're indexed, so the
+straight-line distances the tree works with map exactly onto great-circle
+distances, wherever the teams are.
+"""
+
+from scipy.spatial import cKDTree
+import scipy.sparse as sp
+import pandas as pd
+import numpy as np
+import storage
+
+EARTH_RADIUS = 6371.0
+
+
+def normalize_zip(zips) -> pd.Series:
+    """
+    Normalize postal codes to strings. US ZIPs become 5 digits (restoring
+    the leading zeros lost when they were read as numbers, and dropping any
+    ZIP+4 suffix); other codes are upper-cased. Missing codes become NaN.
+    """
+    codes = pd.Series(zips).astype(str).str.strip().str.upper()
+    codes = codes.str.replace(r"\.0$", "", regex=True)
+
+    missing = codes.isin(['', 'NAN', 'NULL', 'NONE'])
+    digits = codes.str.match(r"^\d{1,5}(-\d{4})?$")
+    codes = codes.where(~digits, codes.str.split('-').str[0].str.zfill(5))
+
+    return codes.where(~missing, np.nan)
+
+
+def read_income(filename) -> pd.DataFrame:
+    """ Read median household income by ZIP from an ACS S1903 table """
+    income = pd.read_csv(filename, usecols=['GEO.id2', 'HC03_EST_VC02'], dtype=str)
+    income.columns = ['ZIP', 'income']
+    income['ZIP'] = normalize_zip(income.ZIP)
+    income['income'] = pd.to_numeric(income.income.str.replace(r"[,+]", "", regex=True), errors='coerce')
+    return income
+
+
+def team_table(zips_file, income_file=None, info_file=None, cache=None) -> pd.DataFrame:
+    """
+    Build a table of every team's ZIP, income and coordinates, indexed by
+    team. Income and coordinates are joined only if their files are given.
+    If a cache file is given it's reused until any of the sources change.
+    """
+    sources = [f for f in [zips_file, income_file, info_file] if f is not None]
+    if storage.is_fresh(cache, sources):
+        return pd.read_csv(cache, index_col='Team', dtype={ 'Zip': str })
+
+    table = pd.read_csv(zips_file, usecols=['Team', 'Zip'], dtype={ 'Zip': str })
+    table['Zip'] = normalize_zip(table.Zip)
+    table = table.drop_duplicates('Team').set_index('Team')
+
+    if income_file is not None:
+        income = read_income(income_file).drop_duplicates('ZIP').set_index('ZIP')
+        table['income'] = income.income.reindex(table.Zip).to_numpy()
+
+    if info_file is not None:
+        info = pd.read_csv(info_file, usecols=['Team', 'Latitude', 'Longitude'], na_values=['null'])
+        info = info.drop_duplicates('Team').set_index('Team')
+        table = table.join(info, how='left')
+
+    if cache is not None:
+        table.to_csv(cache)
+
+    return table
+
+
+def to_unit_sphere(latitude, longitude) -> np.ndarray:
+    """ Get the 3-dimensional unit vectors of points given in degrees """
+    lat, lon = np.radians(latitude), np.radians(longitude)
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
+
+
+def chord(km):
+    """ Get the straight-line distance on the unit sphere of a great-circle distance """
+    return 2 * np.sin(np.minimum(np.asarray(km) / (2 * EARTH_RADIUS), np.pi / 2))
+
+
+def great_circle(chords):
+    """ Get the great-circle distance in km of a straight-line distance on the unit sphere """
+    return 2 * EARTH_RADIUS * np.arcsin(np.clip(np.asarray(chords) / 2, 0, 1))
+
+
+class TeamLocations:
+    """ A KD-tree over the coordinates of every team with a known location """
+
+    def __init__(self, table):
+        """ Takes a table indexed by team with Latitude and Longitude columns """
+        located = table.loc[table.Latitude.notna() & table.Longitude.notna(), :]
+        self.teams = located.index.to_numpy()
+        self.points = to_unit_sphere(located.Latitude.to_numpy(dtype=np.float64),
+            located.Longitude.to_numpy(dtype=np.float64))
+        self.tree = cKDTree(self.points)
+
+
+    def nearest(self, latitude, longitude, k=5) -> pd.DataFrame:
+        """ Get the k teams nearest to a point, and their distances in km """
+        distance, i = self.tree.query(to_unit_sphere(latitude, longitude), k=min(k, len(self.teams)))
+        return pd.DataFrame({ 'team': self.teams[np.atleast_1d(i)], 'km': great_circle(np.atleast_1d(distance)) })
+
+
+    def within(self, latitude, longitude, km) -> np.ndarray:
+        """ Get the teams within a distance of a point """
+        return self.teams[np.sort(self.tree.query_ball_point(to_unit_sphere(latitude, longitude), chord(km)))]
+
+
+    def neighbours(self, km) -> sp.csr_matrix:
+        """ Get a sparse team x team matrix of the distances in km between teams closer than `km` """
+        pairs = self.tree.query_pairs(chord(km), output_type='ndarray')
+        d = great_circle(np.linalg.norm(self.points[pairs[:, 0]] - self.points[pairs[:, 1]], axis=1))
+        n = len(self.teams)
+        upper = sp.csr_matrix((d, (pairs[:, 0], pairs[:, 1])), shape=(n, n))
+        return (upper + upper.T).tocsr()
+
+
+    def neighbourhood_mean(self, values, km, include_self=False) -> pd.DataFrame:
+        """
+        Average a value (e.g. rating) over the teams within `km` of every
+        team. Takes a Series indexed by team; teams without a value are left
+        out of the averages. Returns the mean and the number of teams
+        averaged for each team.
+        """
+        x = pd.Series(values).reindex(self.teams).to_numpy(dtype=np.float64)
+        known = np.isfinite(x)
+
+        adjacent = self.neighbours(km)
+        adjacent.data[:] = 1
+        if include_self:
+            adjacent = adjacent + sp.identity(len(self.teams), format='csr')
+
+        n = adjacent @ known.astype(np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = (adjacent @ np.where(known, x, 0)) / n
+
+        return pd.DataFrame({ 'mean': mean, 'n': n.astype(np.int64) }, index=pd.Index(self.teams, name='Team'))
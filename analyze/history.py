@@ -0,0 +1,197 @@
+import numpy as np
+import pandas as pd
+import storage
+
+
+class RatingHistory:
+    """
+    Week-by-week snapshots of a model's rating table.
+
+    Each snapshot only stores the teams whose ratings changed since the one
+    before it, so a whole season costs about as much as the teams that played
+    in it. Snapshots are keyed by the week they lead into, and every season
+    is closed with a snapshot keyed by week CLOSE, so `as_of(team, 2018, 4)`
+    is the rating a team had after every match before week 4 of 2018, and
+    `as_of(team, 2018, CLOSE)` its rating at the end of 2018.
+    """
+
+    FILES = ['teams', 'keys', 'base', 'offsets', 'index', 'values']
+    CLOSE = 99
+
+    def __init__(self, fields=('Rating',)):
+        self.fields = list(fields)
+        self.teams = None
+        self.current = None
+
+        self._keys = []
+        self._index = []
+        self._values = []
+        self._last = None
+        self._dirty = False
+
+
+    @staticmethod
+    def key(year, week) -> int:
+        """ Get the sortable snapshot key for a week """
+        return int(year) * 100 + int(week)
+
+
+    def is_new_week(self, year, week) -> bool:
+        """ Determine whether a match from this week starts a new snapshot """
+        return self.current != self.key(year, week)
+
+
+    def advance(self, year, week, table:pd.DataFrame):
+        """
+        Record the snapshots a match from the given week needs before it's
+        rated: the close of the previous season if it starts a new one, and
+        the ratings going into its week if it starts a new week.
+        """
+        if not self.is_new_week(year, week):
+            return
+
+        if self.current is not None and self.current // 100 != int(year):
+            self.close(table)
+        self.record(year, week, table)
+
+
+    def close(self, table:pd.DataFrame):
+        """ Record the ratings at the end of the current season, unless it's already closed """
+        if self.current is not None and self.current % 100 != self.CLOSE:
+            self.record(self.current // 100, self.CLOSE, table)
+
+
+    def record(self, year, week, table:pd.DataFrame):
+        """
+        Record the ratings going into the given week. The table must be
+        indexed by team and contain a column for each tracked field.
+        """
+        if self.teams is None:
+            self.teams = np.array(table.index)
+            self._lookup = { t:i for i,t in enumerate(self.teams) }
+            self.base = table.loc[:, self.fields].to_numpy(dtype=np.float64)
+            self._last = self.base.copy()
+
+        new = table.index.difference(pd.Index(self.teams), sort=False)
+        if len(new):
+            # teams added since the last snapshot start from their current ratings
+            start = table.loc[new, self.fields].to_numpy(dtype=np.float64)
+            self.teams = np.concatenate([self.teams, np.array(new)])
+            self._lookup = { t:i for i,t in enumerate(self.teams) }
+            self.base = np.concatenate([self.base, start])
+            self._last = np.concatenate([self._last, start])
+
+        values = table.loc[:, self.fields].reindex(self.teams).to_numpy(dtype=np.float64)
+        changed = np.flatnonzero((values != self._last).any(axis=1))
+
+        self._keys.append(self.key(year, week))
+        self._index.append(changed.astype(np.int32))
+        self._values.append(values[changed])
+
+        self._last = values
+        self.current = self.key(year, week)
+        self._dirty = True
+
+
+    def compact(self):
+        """ Pack the recorded snapshots into flat arrays and index them by team """
+        if not self._dirty:
+            return
+
+        self.keys = np.array(self._keys, dtype=np.int64)
+        self.offsets = np.zeros(len(self._index) + 1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum([len(i) for i in self._index])
+        self.index = np.concatenate(self._index) if self._index else np.zeros(0, np.int32)
+        self.values = np.concatenate(self._values) if self._values else np.zeros((0, len(self.fields)))
+
+        self._build_lookup()
+        self._dirty = False
+
+
+    def _build_lookup(self):
+        """ Sort change entries by team so each team's history is contiguous """
+        snapshot = np.repeat(np.arange(len(self.keys)), np.diff(self.offsets))
+
+        self._order = np.argsort(self.index, kind='stable')
+        self._snapshot = snapshot[self._order]
+        self._team_start = np.zeros(len(self.teams) + 1, dtype=np.int64)
+        self._team_start[1:] = np.cumsum(np.bincount(self.index, minlength=len(self.teams)))
+        self._lookup = { t:i for i,t in enumerate(self.teams) }
+
+
+    def _snapshot_for(self, year, week) -> int:
+        """
+        Get the snapshot holding the ratings after every match before the
+        given week. No matches are played between a week and the first
+        snapshot at or after it, so that's the one; weeks after the last
+        snapshot get the last one.
+        """
+        s = np.searchsorted(self.keys, self.key(year, week), side='left')
+        return min(s, len(self.keys) - 1)
+
+
+    def as_of(self, team, year, week) -> np.ndarray:
+        """
+        Get the tracked fields for a team after every match before the given
+        week, e.g. going into it, or at the end of the season for any week
+        after the season's last.
+        """
+        self.compact()
+
+        i = self._lookup[team]
+        s = self._snapshot_for(year, week)
+
+        start, end = self._team_start[i], self._team_start[i+1]
+        j = np.searchsorted(self._snapshot[start:end], s, side='right') - 1
+
+        if s < 0 or j < 0:
+            return self.base[i]
+
+        return self.values[self._order[start + j]]
+
+
+    def table(self, year, week) -> pd.DataFrame:
+        """ Rebuild the full rating table after every match before the given week """
+        self.compact()
+
+        s = self._snapshot_for(year, week)
+        values = self.base.copy()
+        for k in range(s + 1):
+            lo, hi = self.offsets[k], self.offsets[k+1]
+            values[self.index[lo:hi]] = self.values[lo:hi]
+
+        output = pd.DataFrame(values, index=self.teams, columns=self.fields)
+        output.index.name = 'Team'
+        return output
+
+
+    def save(self, path):
+        """ Write the history to a directory of .npy files """
+        self.compact()
+        storage.save_arrays(path, { name: getattr(self, name) for name in self.FILES }, { 'fields': self.fields })
+
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """
+        Load a saved history, memory-mapping its arrays by default. New
+        snapshots can still be recorded; they're kept in memory until saved.
+        """
+        arrays, meta = storage.load_arrays(path, mmap_mode)
+
+        history = cls(meta['fields'])
+        for name in cls.FILES:
+            setattr(history, name, arrays[name])
+
+        history.current = int(history.keys[-1]) if len(history.keys) else None
+        history._build_lookup()
+
+        # keep the snapshots in recording form so the history can be extended
+        history._keys = list(history.keys)
+        history._index = np.split(history.index, history.offsets[1:-1])
+        history._values = np.split(history.values, history.offsets[1:-1])
+        history._last = history.base.copy()
+        for index, values in zip(history._index, history._values):
+            history._last[index] = values
+
+        return history
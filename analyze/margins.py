@@ -0,0 +1,251 @@
+"""
+Empirical win margin distributions.
+
+Turns a predicted win margin into a win probability without assuming the
+margin is normal. The distribution of the margin (or of a predictor's margin
+errors) is tabulated for every year, week and competition level, so P(win)
+for a whole batch of predictions is a vectorized table lookup:
+
+    P(blue wins | predicted margin m) = P(m + E > 0) = 1 - F(-m)
+
+where F is the CDF of the error E, counting ties as half a win. Groups with
+too few matches fall back to the same year and level, then the year, then
+every match.
+"""
+
+import pandas as pd
+import numpy as np
+import storage
+import os
+
+
+class MarginDistributions:
+
+    LEVELS = ['qm', 'qf', 'sf', 'f']
+    ANY = -1
+
+    # the grouping of each fallback, finest first
+    GROUPINGS = [('year', 'week', 'level'), ('year', 'level'), ('year',), ()]
+
+    def __init__(self, centers, keys, cdf, counts, min_count=200):
+        """
+        Arguments:
+
+        centers   -- the evenly spaced margins the CDFs are tabulated at.
+
+        keys      -- a G x 3 array of the year, week and level code of each
+        group, with ANY where a group spans every value.
+
+        cdf       -- a G x len(centers) array of each group's CDF at the
+        centers, counting the mass at a center as half below it.
+
+        counts    -- the number of margins in each group.
+
+        min_count -- groups with fewer margins than this fall back to a
+        coarser group.
+        """
+        self.centers = np.asarray(centers, dtype=np.float64)
+        self.keys = np.asarray(keys, dtype=np.int64).reshape(-1, 3)
+        self.cdf = np.asarray(cdf, dtype=np.float64)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.min_count = min_count
+        self._lookup = pd.Index(self._codes(*self.keys.T))
+
+
+    @staticmethod
+    def _codes(year, week, level) -> np.ndarray:
+        """ Pack group keys into single integers """
+        return (np.asarray(year, dtype=np.int64) * 1000 + np.asarray(week, dtype=np.int64) + 1) * 10 \
+            + np.asarray(level, dtype=np.int64) + 1
+
+
+    @classmethod
+    def level_codes(cls, levels) -> np.ndarray:
+        """ Get the code of each competition level, with ANY for unknown levels """
+        return pd.Series(levels).map({ l:i for i,l in enumerate(cls.LEVELS) }).fillna(cls.ANY).to_numpy(dtype=np.int64)
+
+
+    @classmethod
+    def fit(cls, margins, year, week, level, predicted=None, width=1.0, smooth=True, bandwidth=None,
+        symmetric=True, min_count=200):
+        """
+        Tabulate the distribution of margins, or of margin errors, for every
+        group of matches.
+
+        Arguments:
+
+        margins   -- the actual margin of each match, blue minus red.
+
+        year, week, level -- the year, week and competition level of each
+        match ('qm', 'qf', 'sf' or 'f').
+
+        predicted -- the predicted margin of each match. If given, the
+        distributions are of the errors, margins - predicted.
+
+        width     -- the spacing of the table, in points.
+
+        smooth    -- smooth the histograms with a Gaussian kernel density
+        estimate, done as a product with the kernel's Fourier transform.
+
+        bandwidth -- the kernel's standard deviation. Defaults to Silverman's
+        rule for each group.
+
+        symmetric -- count every margin from both alliances' side, since it
+        doesn't matter which alliance is called blue.
+        """
+        errors = np.asarray(margins, dtype=np.float64)
+        if predicted is not None:
+            errors = errors - np.asarray(predicted, dtype=np.float64)
+        valid = np.isfinite(errors)
+        errors = errors[valid]
+        columns = {
+            'year': np.asarray(year, dtype=np.int64)[valid],
+            'week': np.asarray(week, dtype=np.int64)[valid],
+            'level': cls.level_codes(level)[valid],
+        }
+
+        # a grid centred on zero, wide enough for every error and the kernel's tails
+        half = int(np.ceil(np.abs(errors).max(initial=0) / width)) + 1
+        if smooth:
+            spread = bandwidth if bandwidth is not None else np.std(errors) if len(errors) else 0
+            half += int(np.ceil(4 * spread / width))
+        centers = np.arange(-half, half + 1) * width
+        bins = np.clip(np.round(errors / width).astype(np.int64) + half, 0, len(centers) - 1)
+
+        keys, histograms = [], []
+        for grouping in cls.GROUPINGS:
+            key = np.stack([columns[c] if c in grouping else np.full(len(errors), cls.ANY)
+                for c in ['year', 'week', 'level']], axis=1)
+            unique, group = np.unique(key, axis=0, return_inverse=True)
+            group = group.ravel()
+            H = np.bincount(group * len(centers) + bins, minlength=len(unique) * len(centers)) \
+                .reshape(len(unique), len(centers)).astype(np.float64)
+            keys.append(unique)
+            histograms.append(H)
+
+        keys, H = np.concatenate(keys), np.concatenate(histograms)
+        if symmetric:
+            H = H + H[:, ::-1]
+        counts = H.sum(axis=1)
+
+        if smooth:
+            H = cls._smooth(H, centers, bandwidth)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            p = H / H.sum(axis=1, keepdims=True)
+        cdf = np.cumsum(p, axis=1) - p / 2
+        if symmetric:
+            counts = counts / 2
+
+        return cls(centers, keys, cdf, counts.astype(np.int64), min_count)
+
+
+    @staticmethod
+    def _smooth(H, centers, bandwidth=None) -> np.ndarray:
+        """
+        Convolve each histogram with a Gaussian kernel, multiplying by the
+        kernel's Fourier transform. Padding to twice the length keeps the
+        circular convolution from wrapping around.
+        """
+        width = centers[1] - centers[0]
+        n = H.sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = H @ centers / n
+            sd = np.sqrt(H @ centers**2 / n - mean**2)
+        h = np.full(len(H), bandwidth, dtype=np.float64) if bandwidth is not None \
+            else np.nan_to_num(1.06 * sd * n**-0.2)
+
+        size = 2 * len(centers)
+        f = np.fft.rfftfreq(size, d=width)
+        kernel = np.exp(-2 * (np.pi * f[None, :] * h[:, None])**2)
+        smoothed = np.fft.irfft(np.fft.rfft(H, n=size, axis=1) * kernel, n=size, axis=1)[:, :len(centers)]
+
+        return np.maximum(smoothed, 0)
+
+
+    @classmethod
+    def from_matchdata(cls, data, **kwargs):
+        """
+        Tabulate the margins of a MatchData_ol frame, skipping unplayed
+        matches. A `predicted` margin, if given, is one per row of `data`.
+        """
+        played = ((data['blue score'] >= 0) & (data['red score'] >= 0)).to_numpy()
+        if kwargs.get('predicted') is not None:
+            kwargs['predicted'] = np.asarray(kwargs['predicted'], dtype=np.float64)[played]
+        data = data.loc[played, :]
+        return cls.fit(data['blue score'] - data['red score'], data.Year, data.Week, data['Competition Level'], **kwargs)
+
+
+    @classmethod
+    def from_files(cls, years, data_dir="../data", cache=None, **kwargs):
+        """
+        Tabulate the margins of the MatchData_ol files of a range of years.
+        If a cache file is given it's reused until any of the files change.
+        """
+        files = [os.path.join(data_dir, f"{y}_MatchData_ol.csv") for y in years]
+        if storage.is_fresh(cache, files):
+            return cls.load(cache)
+
+        data = pd.concat([pd.read_csv(f) for f in files], ignore_index=True)
+        distributions = cls.from_matchdata(data, **kwargs)
+        if cache is not None:
+            distributions.save(cache)
+
+        return distributions
+
+
+    def groups(self, year, week, level) -> np.ndarray:
+        """
+        Get the group to use for each match: the finest one with at least
+        `min_count` margins.
+        """
+        level = self.level_codes(np.ravel(level)).reshape(np.shape(level))
+        year, week, level = np.broadcast_arrays(np.asarray(year, dtype=np.int64), np.asarray(week, dtype=np.int64), level)
+        shape = year.shape
+        year, week, level = year.ravel(), week.ravel(), level.ravel()
+
+        chosen = np.full(len(year), -1, dtype=np.int64)
+        spans = np.full(len(year), self.ANY)
+        for grouping in self.GROUPINGS:
+            g = self._lookup.get_indexer(self._codes(
+                year if 'year' in grouping else spans,
+                week if 'week' in grouping else spans,
+                level if 'level' in grouping else spans))
+            usable = (g >= 0) & (chosen < 0)
+            usable[usable] = self.counts[g[usable]] >= self.min_count
+            chosen[usable] = g[usable]
+
+        # the overall group stands in when nothing reaches min_count
+        overall = self._lookup.get_indexer(self._codes([self.ANY], [self.ANY], [self.ANY]))[0]
+        return np.where(chosen < 0, overall, chosen).reshape(shape)
+
+
+    def cdf_at(self, x, groups) -> np.ndarray:
+        """ Evaluate the CDFs of the given groups at x, interpolating between the centers """
+        position = (np.asarray(x, dtype=np.float64) - self.centers[0]) / (self.centers[1] - self.centers[0])
+        position = np.clip(position, 0, len(self.centers) - 1)
+        lo = np.minimum(np.floor(position).astype(np.int64), len(self.centers) - 2)
+        t = position - lo
+
+        below, above = self.cdf[groups, lo], self.cdf[groups, lo + 1]
+        return below + t * (above - below)
+
+
+    def win_probability(self, margin, year, week, level) -> np.ndarray:
+        """ Get the probability that blue wins from each predicted blue minus red margin """
+        margin = np.asarray(margin, dtype=np.float64)
+        groups = np.broadcast_to(self.groups(year, week, level), margin.shape)
+        return np.clip(1 - self.cdf_at(-margin, groups), 0, 1)
+
+
+    def save(self, filename):
+        """ Save the tables to an .npz file """
+        np.savez(filename, centers=self.centers, keys=self.keys, cdf=self.cdf, counts=self.counts,
+            min_count=self.min_count)
+
+
+    @classmethod
+    def load(cls, filename):
+        """ Load tables saved with `save` """
+        with np.load(filename, allow_pickle=False) as f:
+            return cls(f['centers'], f['keys'], f['cdf'], f['counts'], int(f['min_count']))
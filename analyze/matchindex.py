@@ -0,0 +1,157 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import storage
+import os
+
+
+class MatchIndex:
+    """
+    Which teams played in which matches, across every season.
+
+    A sparse team x match incidence matrix holds +1 where a team played for
+    blue and -1 for red. With M that matrix, |M||M|ᵀ counts the matches any
+    two teams shared and M Mᵀ counts them as partners minus as opponents,
+    so both co-occurrence matrices are one sparse product. Finding the
+    matches a set of teams shared only touches those teams' rows.
+    """
+
+    SIDES = { 'blue': 1, 'red': -1 }
+
+    def __init__(self, teams, keys, years, incidence):
+        self.teams = np.asarray(teams)
+        self._index = pd.Index(self.teams)
+        self.keys = np.asarray(keys)
+        self.years = np.asarray(years)
+        self.incidence = incidence
+        self._partners = None
+        self._opponents = None
+
+
+    @classmethod
+    def build(cls, data):
+        """
+        Index a MatchData frame (one row per robot, any number of seasons).
+        Only the Key, Year, Team and Alliance columns are used.
+        """
+        match, keys = pd.factorize(data.Key)
+        teams, team = np.unique(data.Team.to_numpy(), return_inverse=True)
+        years = data.Year.groupby(match).first().to_numpy()
+        sides = data.Alliance.map(cls.SIDES).to_numpy(dtype=np.int8)
+
+        incidence = sp.csr_matrix((sides, (team, match)), shape=(len(teams), len(keys)), dtype=np.int8)
+        incidence.sum_duplicates()
+        incidence.sort_indices()
+
+        return cls(teams, np.asarray(keys).astype(str), years, incidence)
+
+
+    @classmethod
+    def from_files(cls, years, data_dir="../data"):
+        """ Index the MatchData_basic files of a range of years """
+        columns = ['Key', 'Year', 'Team', 'Alliance']
+        data = pd.concat([pd.read_csv(os.path.join(data_dir, f"{y}_MatchData_basic.csv"), usecols=columns)
+            for y in years], ignore_index=True)
+        return cls.build(data)
+
+
+    def rows(self, teams) -> np.ndarray:
+        """ Get the row of each team in the incidence matrix """
+        return storage.team_positions(self._index, teams)
+
+
+    def _cooccurrence(self):
+        """ Count the matches every pair of teams played as partners and as opponents """
+        signed = self.incidence.astype(np.int32)
+        together = abs(signed) @ abs(signed).T
+        balance = signed @ signed.T
+
+        together = together - sp.diags(together.diagonal())
+        balance = balance - sp.diags(balance.diagonal())
+
+        self._partners = (together + balance).tocsr().astype(np.int32)
+        self._opponents = (together - balance).tocsr().astype(np.int32)
+        for m in (self._partners, self._opponents):
+            m.data //= 2
+            m.eliminate_zeros()
+
+
+    @property
+    def partners(self) -> sp.csr_matrix:
+        """ Team x team counts of matches played on the same alliance """
+        if self._partners is None:
+            self._cooccurrence()
+        return self._partners
+
+
+    @property
+    def opponents(self) -> sp.csr_matrix:
+        """ Team x team counts of matches played on opposing alliances """
+        if self._opponents is None:
+            self._cooccurrence()
+        return self._opponents
+
+
+    def pair_counts(self, a, b) -> pd.DataFrame:
+        """ Count the matches between paired arrays of teams, as partners and as opponents """
+        i, j = self.rows(np.atleast_1d(a)), self.rows(np.atleast_1d(b))
+        return pd.DataFrame({
+            'team': np.atleast_1d(a),
+            'other': np.atleast_1d(b),
+            'partners': np.asarray(self.partners[i, j]).ravel(),
+            'opponents': np.asarray(self.opponents[i, j]).ravel(),
+        })
+
+
+    def matches(self, teams, relation='any') -> pd.DataFrame:
+        """
+        Find the matches every one of the given teams played in.
+
+        relation -- 'any' for every shared match, 'partners' for matches where
+        they were all on the same alliance, or 'opponents' for matches where
+        they weren't.
+
+        Returns the key and year of each match and the alliance of each team.
+        """
+        rows = self.rows(list(teams))
+        M = self.incidence
+        starts, ends = M.indptr[rows], M.indptr[rows + 1]
+
+        # every match of every team, then the ones all of them share
+        lengths = ends - starts
+        entries = np.arange(lengths.sum()) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        match, count = np.unique(M.indices[entries], return_counts=True)
+        shared = match[count == len(rows)]
+
+        sides = np.asarray(M[rows][:, shared].todense()).reshape(len(rows), -1)
+        if relation == 'partners':
+            keep = np.abs(sides.sum(axis=0)) == len(rows)
+        elif relation == 'opponents':
+            keep = np.abs(sides.sum(axis=0)) < len(rows)
+        elif relation == 'any':
+            keep = np.ones(len(shared), dtype=bool)
+        else:
+            raise ValueError(f"Unknown relation '{relation}', expected 'any', 'partners' or 'opponents'")
+
+        names = { 1: 'blue', -1: 'red' }
+        output = pd.DataFrame({ 'key': self.keys[shared[keep]], 'year': self.years[shared[keep]] })
+        for team, side in zip(teams, sides[:, keep]):
+            output[team] = [names[s] for s in side]
+
+        return output
+
+
+    def save(self, path):
+        """ Write the index to a directory of .npy files """
+        arrays = { 'teams': self.teams, 'keys': self.keys, 'years': self.years, 'indptr': self.incidence.indptr,
+            'indices': self.incidence.indices, 'sides': self.incidence.data }
+        storage.save_arrays(path, arrays, { 'shape': list(self.incidence.shape) })
+
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """ Load a saved index, memory-mapping its arrays by default """
+        arrays, meta = storage.load_arrays(path, mmap_mode)
+        incidence = sp.csr_matrix((arrays['sides'], arrays['indices'], arrays['indptr']), shape=tuple(meta['shape']))
+
+        return cls(arrays['teams'], arrays['keys'], arrays['years'], incidence)
@@ -3,9 +3,18 @@ import pandas as pd
 import numpy as np
 from typing import Tuple
 import math
+from scipy.special import ndtr
+from scipy.stats import rankdata, norm
+import scipy.sparse as sp
 import tbapy
 import os
 import json
+from history import RatingHistory
+from evaluation import Evaluator
+import tsengine
+import oprengine
+import oprvalidation
+from storage import team_positions
 
 try:
     with open("../keys.json", 'r') as f:
@@ -63,6 +72,50 @@ def sort_data(df):
     return df
 
 
+FORMAT = 'frc-model'
+FORMAT_VERSION = 1
+
+def write_model(filename, kind, teams, arrays:dict, params:dict, metadata:dict):
+    """
+    Write a model to a versioned binary (.npz) file. Parameters and metadata
+    are stored as JSON so the file can be read back without pickle.
+    """
+    np.savez(filename,
+        format=np.array(FORMAT),
+        version=np.array(FORMAT_VERSION),
+        model=np.array(kind),
+        teams=np.asarray(teams, dtype=np.int64),
+        params=np.array(json.dumps(params)),
+        metadata=np.array(json.dumps(metadata)),
+        **arrays)
+
+
+def read_model(filename) -> dict:
+    """ Read the contents of a binary model file written by `write_model` """
+    with np.load(filename, allow_pickle=False) as f:
+        if 'format' not in f.files or str(f['format']) != FORMAT:
+            raise ValueError(f"{filename} is not a model file")
+        if int(f['version']) > FORMAT_VERSION:
+            raise ValueError(f"{filename} uses format version {int(f['version'])}, "
+                f"but only versions up to {FORMAT_VERSION} are supported")
+        contents = { k: f[k] for k in f.files }
+
+    for k in ['format', 'model']:
+        contents[k] = str(contents[k])
+    for k in ['params', 'metadata']:
+        contents[k] = json.loads(str(contents[k]))
+
+    return contents
+
+
+def load_model(filename):
+    """ Load a binary model file into a model of the right type """
+    kind = read_model(filename)['model']
+    model = { 'elo': EloModel, 'ts': TSModel }[kind]()
+    model.load(filename)
+    return model
+
+
 def get_teams(years):
     """
     Get a list of all teams that competed in the given range of years
@@ -76,26 +129,51 @@ def get_teams(years):
 
 class EloModel:
 
-    def __init__(self, teams=[], k=10, n=400, i=1000, logging=False):
+    def __init__(self, teams=[], k=10, n=400, i=1000, logging=False, history=False):
         self.K = k
         self.N = n
         self.I = i
-        self.logging = logging
+        self.evaluator = logging if isinstance(logging, Evaluator) else (Evaluator() if logging else None)
+        self.history = RatingHistory(['Rating']) if history else None
+        self.metadata = {}
 
         self.table = pd.DataFrame(columns=['Team','Rating','Rank'])
-        self.log = {'Key':[], 'Prediction':[]}
         self.table.Team = teams
         self.table.Rating = [self.I] * len(self.table)
         self.table.set_index('Team', inplace=True)
     
 
     def load(self, filename):
-        """ Load the model from a csv file """
+        """ Load the model from a binary (.npz) or csv file """
+        if filename.endswith('.npz'):
+            contents = read_model(filename)
+            self.K, self.N, self.I = (contents['params'][p] for p in ['k', 'n', 'i'])
+            self.metadata = contents['metadata']
+            self.table = pd.DataFrame({ 'Rating': contents['rating'], 'Rank': np.nan },
+                index=pd.Index(contents['teams'], name='Team'))
+            return
+
         csv = pd.read_csv(filename)
         csv.set_index('Team', inplace=True)
         self.table = csv
 
 
+    def save(self, filename, **metadata):
+        """ Save the model to a binary (.npz) file, with optional metadata """
+        params = { 'k': self.K, 'n': self.N, 'i': self.I }
+        arrays = { 'rating': self.table.Rating.to_numpy(dtype=np.float64) }
+        write_model(filename, 'elo', self.table.index, arrays, params, metadata)
+
+
+    def add_teams(self, teams):
+        """ Add any new teams to the table at the initial rating """
+        new = pd.Index(teams).difference(self.table.index, sort=False)
+        if len(new):
+            rows = pd.DataFrame({ 'Rating': [self.I] * len(new) }, index=new)
+            self.table = pd.concat([self.table, rows])
+            self.table.index.name = 'Team'
+
+
     def rate(self, team):
         """ Get the rating for a team """
         return self.table.loc[team, 'Rating']
@@ -103,7 +181,7 @@ class EloModel:
     
     def rate_alliance(self, alliance:Tuple):
         """ Get the total rating of an alliance """
-        return sum(self.table.loc[alliance, 'Rating'])
+        return sum(self.table.loc[list(alliance), 'Rating'])
     
 
     def P(self, r1, r2):
@@ -119,35 +197,69 @@ class EloModel:
         p_b = self.P(r_b, r_r)
 
         return p_b
+
+
+    def predict_many(self, blue_idx, red_idx) -> np.ndarray:
+        """
+        Get the probability that blue wins for many matchups at once. Takes
+        two Mx3 arrays of team numbers and returns an array of M probabilities.
+        """
+        ratings = self.table.Rating.to_numpy(dtype=np.float64)
+
+        r_b = ratings[team_positions(self.table.index, blue_idx)].sum(axis=1)
+        r_r = ratings[team_positions(self.table.index, red_idx)].sum(axis=1)
+
+        return 1.0 / (1 + np.power(10, (r_r - r_b) / self.N))
     
     
+    def snapshot(self, row):
+        """ Record the ratings going into a new week or season, if this match starts one """
+        if self.history is not None:
+            self.history.advance(row.Year, row.Week, self.table)
+
+
+    def close_season(self):
+        """ Record the ratings at the end of the season trained so far """
+        if self.history is not None:
+            self.history.close(self.table)
+
+
+    def as_of(self, team, year, week) -> float:
+        """ Get a team's rating after every match before the given week """
+        return self.history.as_of(team, year, week)[0]
+
+
     def train(self, row):
         """ Train on a single match """
+        self.snapshot(row)
+
         b = row['blue']
         r = row['red']
 
         # find the win probability for blue
         p_b = self.predict(b, r)
 
-        if self.logging:
-            self.log['Key'].append(row.Key)
-            self.log['Prediction'].append(p_b)
+        if self.evaluator is not None:
+            self.evaluator.observe(row, p_b)
             
         # calculate the rating adjustment
         outcome = { 'blue': 1.0, 'red': 0.0, 'tie': 0.5 }[row.winner]
         delta = self.K * (outcome - p_b)
 
         # apply adjustment
-        self.table.loc[row['blue'], 'Rating'] += delta
-        self.table.loc[row['red'], 'Rating'] -= delta
+        self.table.loc[list(b), 'Rating'] += delta
+        self.table.loc[list(r), 'Rating'] -= delta
+
+
+    def train_many(self, data):
+        """ Train on a processed, sorted dataframe of matches, closing the season at the end """
+        data.apply(self.train, axis=1)
+        self.close_season()
     
     
-    def test(self, winner) -> float:
+    def test(self) -> float:
         """ Get the Brier score of the model on the predictions it logged """
-        winner.fillna('tie')
-        f = { 'blue':1, 'red':0, 'tie':0.5 }
-
-        return ((winner.map(f) - self.log['Prediction'])**2).mean()
+        return self.evaluator.brier()
 
 
     def rank(self):
@@ -165,23 +277,82 @@ class EloModel:
 
 class TSModel:
 
-    def __init__(self, teams=[], env=ts.setup(), logging=False):
-        self.logging = logging
+    def __init__(self, teams=[], env=ts.setup(), logging=False, history=False):
+        self.evaluator = logging if isinstance(logging, Evaluator) else (Evaluator() if logging else None)
         self.env = env
-        self.table = pd.DataFrame(columns=['Team','Rating','Score','Rank'])
-        self.log = {'Key':[], 'Prediction':[]}
+        self.history = RatingHistory(['mu','sigma']) if history else None
+        self.metadata = {}
 
-        self.table.Team = teams
-        self.table.Rating = [ts.Rating()] * len(self.table)
-        self.table.set_index('Team', inplace=True)
+        # Ratings are stored as parallel arrays indexed by position in self.index
+        self.index = pd.Index(teams, name='Team')
+        self.mu = np.full(len(self.index), float(env.mu))
+        self.sigma = np.full(len(self.index), float(env.sigma))
+        self.scores = None
+        self.ranks = None
 
 
     def load(self, filename):
-        csv = pd.read_csv(filename)
-        rating = list(map(ts.Rating, zip(csv.mu, csv.sigma)))
-        csv['Rating'] = rating
-        csv.set_index('Team', inplace=True)
-        self.table = csv.drop(['mu','sigma'], axis=1)
+        """ Load the model from a binary (.npz) or csv file """
+        if filename.endswith('.npz'):
+            contents = read_model(filename)
+            self.env = ts.TrueSkill(**contents['params'])
+            self.metadata = contents['metadata']
+            self.index = pd.Index(contents['teams'], name='Team')
+            self.mu = contents['mu']
+            self.sigma = contents['sigma']
+        else:
+            csv = pd.read_csv(filename)
+            self.index = pd.Index(csv.Team, name='Team')
+            self.mu = csv.mu.to_numpy(dtype=np.float64)
+            self.sigma = csv.sigma.to_numpy(dtype=np.float64)
+
+        self.scores = None
+        self.ranks = None
+
+
+    def save(self, filename, **metadata):
+        """ Save the model to a binary (.npz) file, with optional metadata """
+        params = { 'mu': self.env.mu, 'sigma': self.env.sigma, 'beta': self.env.beta,
+            'tau': self.env.tau, 'draw_probability': self.env.draw_probability }
+        arrays = { 'mu': self.mu, 'sigma': self.sigma }
+        write_model(filename, 'ts', self.index, arrays, params, metadata)
+
+
+    def __getstate__(self):
+        """ Store the environment by its parameters, since it can't be pickled """
+        state = dict(self.__dict__)
+        env = state.pop('env')
+        state['env_params'] = (env.mu, env.sigma, env.beta, env.tau, env.draw_probability)
+        return state
+
+
+    def __setstate__(self, state):
+        mu, sigma, beta, tau, draw_probability = state.pop('env_params')
+        state['env'] = ts.TrueSkill(mu, sigma, beta, tau, draw_probability)
+        self.__dict__.update(state)
+
+
+    def add_teams(self, teams):
+        """ Add any new teams to the model at the environment's initial rating """
+        new = pd.Index(teams).difference(self.index, sort=False)
+        if len(new):
+            self.index = self.index.append(pd.Index(new, name='Team'))
+            self.mu = np.concatenate([self.mu, np.full(len(new), float(self.env.mu))])
+            self.sigma = np.concatenate([self.sigma, np.full(len(new), float(self.env.sigma))])
+            self.scores = None
+            self.ranks = None
+
+
+    @property
+    def table(self) -> pd.DataFrame:
+        """ Get the rating table, sorted by score if the model has been ranked """
+        table = pd.DataFrame({ 'mu': self.mu, 'sigma': self.sigma }, index=self.index)
+        if self.ranks is not None:
+            table['Score'] = self.scores
+            table['Rank'] = self.ranks
+            table.sort_values('Score', ascending=False, inplace=True)
+
+        return table
 
 
     def rate(self, team):
@@ -190,91 +361,140 @@ class TSModel:
     
 
     def rate_alliance(self, alliance:Tuple) -> ts.Rating:
-        ratings = list(self.table.loc[alliance, 'Rating'])
+        i = team_positions(self.index, list(alliance))
 
-        mu = sum(r.mu for r in ratings)
-        sigma = math.sqrt(sum((self.env.beta**2 + r.sigma**2) for r in ratings))
+        mu = self.mu[i].sum()
+        sigma = math.sqrt((self.env.beta**2 + self.sigma[i]**2).sum())
 
         return ts.Rating(mu, sigma)
 
     
+    def snapshot(self, row):
+        """ Record the ratings going into a new week or season, if this match starts one """
+        if self.history is not None:
+            self.history.advance(row.Year, row.Week, self.table)
+
+
+    def close_season(self):
+        """ Record the ratings at the end of the season trained so far """
+        if self.history is not None:
+            self.history.close(self.table)
+
+
+    def as_of(self, team, year, week) -> ts.Rating:
+        """ Get a team's rating after every match before the given week """
+        mu, sigma = self.history.as_of(team, year, week)
+        return ts.Rating(mu, sigma)
+
+
     def train(self, row):
         """ Train the model on a single match record """
-        r_blue = list(self.table.loc[row.blue, 'Rating'])
-        r_red = list(self.table.loc[row.red, 'Rating'])
-
-        if self.logging:
-            self.log['Key'].append(row.Key)
-            self.log['Prediction'].append(self.predict(row.blue, row.red))
-
-        if row.winner == 'blue':
-            result = [0,1]
-        elif row.winner == 'red':
-            result = [1,0]
-        elif row.winner == 'tie':
-            result = [0,0]
-        
-        try:
-            new_blue, new_red = ts.rate([r_blue, r_red], result)
-        except ValueError:
-            print(f"Blue Ratings: {r_blue}")
-            print(f"Red Ratings: {r_red}")
-            print(result)
-
-        self.table.loc[row.blue, 'Rating'] = new_blue
-        self.table.loc[row.red, 'Rating'] = new_red
+        self.snapshot(row)
+
+        blue = team_positions(self.index, [list(row.blue)])
+        red = team_positions(self.index, [list(row.red)])
+
+        if self.evaluator is not None:
+            self.evaluator.observe(row, self.predict(row.blue, row.red))
+
+        outcome = { 'blue': 1.0, 'red': 0.0, 'tie': 0.5 }[row.winner]
+        tsengine.rate(self.mu, self.sigma, blue, red, [outcome], self.env)
+
+        new_blue = tuple(ts.Rating(self.mu[i], self.sigma[i]) for i in blue[0])
+        new_red = tuple(ts.Rating(self.mu[i], self.sigma[i]) for i in red[0])
 
         return new_blue, new_red
+
+
+    def train_many(self, data):
+        """
+        Train the model on a processed, sorted dataframe of matches. Matches
+        are rated a week at a time in waves that share no teams, which gives
+        the same ratings as calling `train` on each row in order.
+        """
+        mu, sigma = self.mu, self.sigma
+
+        blue = team_positions(self.index, np.array(data.blue.tolist()))
+        red = team_positions(self.index, np.array(data.red.tolist()))
+        outcome = data.winner.map({ 'blue': 1.0, 'red': 0.0, 'tie': 0.5 }).to_numpy()
+        weeks = (data.Year * 100 + data.Week).to_numpy()
+
+        for key in pd.unique(weeks):
+            rows = np.flatnonzero(weeks == key)
+            year, week = divmod(int(key), 100)
+
+            if self.history is not None:
+                self.history.advance(year, week, self.table)
+
+            b, r, o = blue[rows], red[rows], outcome[rows]
+            p = np.zeros(len(rows))
+            waves = tsengine.schedule(b, r)
+
+            for wave in range(waves.max() + 1):
+                m = waves == wave
+                delta = mu[b[m]].sum(axis=1) - mu[r[m]].sum(axis=1)
+                var = (sigma[b[m]]**2).sum(axis=1) + (sigma[r[m]]**2).sum(axis=1)
+                p[m] = ndtr(delta / np.sqrt(var + (b.shape[1] + r.shape[1]) * self.env.beta**2))
+
+                tsengine.rate(mu, sigma, b[m], r[m], o[m], self.env)
+
+            if self.evaluator is not None:
+                week_data = data.iloc[rows]
+                self.evaluator.update_many(year, week, week_data.comp_level,
+                    p, week_data.winner, week_data.Key.to_numpy())
+
+        self.close_season()
     
 
     def scale_sigma(self, k=2.0):
         """ Scale the standard deviation of all scores by k """
-        scale = lambda r: ts.Rating(r.mu, k * r.sigma)
-        self.table.Rating = self.table.Rating.map(scale)
+        self.sigma *= k
     
 
     def predict(self, blue, red) -> float:
         """ Predict the outcome of a match """
-        r_blue = list(self.table.loc[blue, 'Rating'])
-        r_red = list(self.table.loc[red, 'Rating'])
+        p_blue_win, _ = self.predict_many([list(blue)], [list(red)])
+        return p_blue_win[0]
 
-        blue_mu = sum(r.mu for r in r_blue)
-        blue_sigma = sum((self.env.beta**2 + r.sigma**2) for r in r_blue)
 
-        red_mu = sum(r.mu for r in r_red)
-        red_sigma = sum((self.env.beta**2 + r.sigma**2) for r in r_red)
+    def predict_many(self, blue_idx, red_idx) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Predict many matchups at once. Takes two Mx3 arrays of team numbers and
+        returns arrays of the M blue win probabilities and match qualities.
+        """
+        blue = team_positions(self.index, blue_idx)
+        red = team_positions(self.index, red_idx)
+
+        delta = self.mu[blue].sum(axis=1) - self.mu[red].sum(axis=1)
+        spread = self.env.beta**2 * (blue.shape[1] + red.shape[1])
+        var = spread + (self.sigma[blue]**2).sum(axis=1) + (self.sigma[red]**2).sum(axis=1)
 
-        x = (blue_mu - red_mu) / math.sqrt(blue_sigma+red_sigma)
-        p_blue_win = self.env.cdf(x)
-        return p_blue_win
+        p_blue_win = ndtr(delta / np.sqrt(var))
+        quality = np.sqrt(spread / var) * np.exp(-0.5 * delta**2 / var)
+
+        return p_blue_win, quality
     
 
-    def test(self, winner) -> float:
+    def test(self) -> float:
         """ Get the Brier score of the model on the predictions it logged """
-        winner.fillna('tie')
-        f = { 'blue':1, 'red':0, 'tie':0.5 }
-
-        return ((winner.map(f) - self.log['Prediction'])**2).mean()
+        return self.evaluator.brier()
 
 
     def quality(self, blue, red) -> float:
         """ Get the generalized quality of a match """
-        r_blue = list(self.table.loc[blue, 'Rating'])
-        r_red = list(self.table.loc[red, 'Rating'])
-
-        return ts.quality((r_blue,r_red))
+        _, quality = self.predict_many([list(blue)], [list(red)])
+        return quality[0]
     
 
     def score(self):
-        """ Calculate scores for all teams and add into table """
-        self.table.Score = self.table.Rating.map(self.env.expose)
+        """ Calculate conservative scores for all teams """
+        self.scores = self.mu - (self.env.mu / self.env.sigma) * self.sigma
     
 
     def rank(self):
         """ Score all teams and rank them according to their score """
         self.score()
-        self.table.Rank = self.table.Score.rank(ascending=False)
-        self.table.sort_values('Score', ascending=False, inplace=True)
+        self.ranks = rankdata(-self.scores)
     
 
     def export(self, filename:str) -> pd.DataFrame:
@@ -282,13 +502,7 @@ class TSModel:
         columns = ['mu','sigma','Score','Rank']
 
         self.rank()
-        ratings = map(list, self.table.Rating)
-        ratings_inv = list(zip(*ratings))
-
-        output = self.table.drop('Rating', axis=1)
-        output['mu'] = ratings_inv[0]
-        output['sigma'] = ratings_inv[1]
-
+        output = self.table
         output.to_csv(filename, columns=columns)
 
         return output
@@ -297,7 +511,9 @@ class TSModel:
 class OPRModel:
 
     def __init__(self):
-        pass
+        self.table = None
+        self.info = None
+        self.posterior = None
 
 
     @staticmethod
@@ -306,9 +522,9 @@ class OPRModel:
         Import a file produced by MatchData_oneline and build a DataFrame that can
         be used to construct the sparse matrix and train the model.
         """
-        DROPS = ['Year','Event','Week','comp_level','set','match','winner','City','State','Country','Time']
+        DROPS = ['Year','comp_level','set','match','winner','City','State','Country','Time']
         COLS_REN = {
-            'Key': 'key',
+            'Key': 'key', 'Event': 'event', 'Week': 'week',
             'blue score':'score',  'blue':'teams',
             'red score':'score',   'red':'teams'
         }
@@ -319,17 +535,19 @@ class OPRModel:
         data = data.drop(DROPS, axis=1)
 
         # Break into alliances
-        blue = data[['blue score', 'blue']].copy()
+        blue = data[['Key', 'blue score', 'blue', 'Event', 'Week']].copy()
         blue['Alliance'] = ['blue']*len(blue)
         blue.rename(columns=COLS_REN, inplace=True)
 
-        red = data[['red score','red']].copy()
+        red = data[['Key', 'red score','red', 'Event', 'Week']].copy()
         red['Alliance'] = ['red']*len(red)
         red.rename(columns=COLS_REN, inplace=True)
 
-        data = pd.concat([blue,red], axis=0).sort_index()
+        # keep sort_data's order, with each match's blue row before its red row
+        data = pd.concat([blue,red], axis=0)
+        data = data.iloc[np.argsort(np.tile(np.arange(len(blue)), 2), kind='stable')]
         data.set_index([data.index,"Alliance"], inplace=True)
-        data = data[['teams','score']]
+        data = data[['key','teams','score','event','week']]
 
         teams = list(set([t for a in data.teams for t in a]))
 
@@ -338,67 +556,354 @@ class OPRModel:
 
     def build_sparse_matrix(self, data, teams=None):
         """
-        Build the sparse matrix from match-alliance pairs and event-match keys.
-        If no list of teams is given, extract names of all teams from data
+        Build the sparse design matrix from match-alliance pairs, with a row
+        for each alliance-match and a column for each team. If no list of
+        teams is given, extract names of all teams from data
         """
-        
+        members = np.array(data.teams.tolist())
+
         if teams is None:
-            teams = list(set([ t for a in data.teams for t in a ]))
-        self.teams = teams
+            teams = np.unique(members)
+        self.teams = list(teams)
 
-        index = lambda r: '_'.join(map(str, r.name))
+        cols = team_positions(pd.Index(self.teams), members.ravel())
+        rows = np.repeat(np.arange(len(members)), members.shape[1])
 
-        row = {t:0 for t in self.teams}
-        sparse = { index(r):dict(row) for i,r in data.iterrows() }
+        sparse = sp.csr_matrix((np.ones(len(cols)), (rows, cols)), shape=(len(members), len(self.teams)))
+        sparse.sum_duplicates()
+        sparse.data[:] = 1
+        self.sparse = sparse
 
-        def f(row):
-            sparse[index(row)].update(dict(zip(row.teams, [1,1,1])))
-        
-        data.apply(f, axis=1)
+        return self.sparse
 
-        sparse_m = np.array([list(d.values()) for d in sparse.values()])
-    
-        self.sparse = sparse_m
 
-        return self.sparse
+    @staticmethod
+    def _targets(y):
+        """ Get the column names and a 2-dimensional float array of the targets in y """
+        if isinstance(y, pd.DataFrame):
+            columns = list(y.columns)
+        elif np.ndim(y) == 1:
+            columns = ['opr']
+        else:
+            columns = list(range(np.shape(y)[1]))
+
+        return columns, np.asarray(y, dtype=np.float64).reshape(len(y), -1)
 
 
-    def train(self, data, y):
+    def train(self, data, y, method='lsqr', tol=1e-8, maxiter=None, warm_start=False):
         """
         Construct the sparse matrix and fit OPRs for the scores in y. Returns
         a dataframe representation of the OPR table.
 
         Arguments:
 
-        data -- a dataframe with a column `teams` which contains tuples of the
-        members of each alliance for each alliance-match record.
+        data       -- a dataframe with a column `teams` which contains tuples of
+        the members of each alliance for each alliance-match record.
 
-        y    -- a 1-dimensional numpy array of the scores of each
+        y          -- a 1-dimensional numpy array of the scores of each
         alliance-match. These must be in the same order as `data`, but they can
-        represent any metric that the model should solve for.
+        represent any metric that the model should solve for. A 2-dimensional
+        array or dataframe fits one column of OPRs per target.
+
+        method     -- solver to use; see `oprengine.solve`.
+
+        tol        -- relative stopping tolerance for the iterative solvers.
+
+        maxiter    -- iteration limit for the iterative solvers.
+
+        warm_start -- start from the current OPRs of any team already in the
+        table, e.g. when retraining after another week of matches.
+
+        Convergence diagnostics for each target are kept in `info` and the
+        residual of each alliance-match in `resid`.
         """
         self.build_sparse_matrix(data)
 
-        coef = self.sparse.astype(np.bool)
-        #scores = y.to_numpy()
-        scores = np.array(y, dtype=np.uint8)
+        columns, scores = self._targets(y)
+
+        x0 = np.zeros((len(self.teams), len(columns)))
+        if warm_start and self.table is not None:
+            x0 = self.table.reindex(index=self.teams, columns=columns).fillna(0).to_numpy(dtype=np.float64)
+
+        oprs = np.zeros_like(x0)
+        info = []
+        for j in range(len(columns)):
+            oprs[:,j], result = oprengine.solve(self.sparse, scores[:,j], method, tol, maxiter, x0[:,j])
+            info.append(result)
+            if not result['converged']:
+                print(f"OPR solver did not converge for target {columns[j]}")
 
-        print("coef shape:", coef.shape)
-        print("y shape:", y.shape)
-        oprs, self.resid,_,_ = np.linalg.lstsq(coef, scores, rcond=-1)
+        self.info = pd.DataFrame(info, index=columns)
+        self.resid = scores - self.sparse @ oprs
+        if np.ndim(y) == 1:
+            oprs, self.resid = oprs[:,0], self.resid[:,0]
 
         self.opr_dict = { t:o for (t,o) in zip(self.teams, oprs) }
 
-        self.table = pd.DataFrame(oprs, index=self.teams)
+        self.table = pd.DataFrame(oprs.reshape(len(self.teams), -1), index=self.teams, columns=columns)
         self.table.index.name = 'team'
-        #self.table.sort_values('opr', ascending=False, inplace=True)
 
         return self.table
 
 
-    def predict(self, alliance):
-        """ Predict the total score for an alliance """
-        return self.table.loc[alliance, "opr"].sum()
+    def train_events(self, data, y, by='event'):
+        """
+        Fit a separate OPR for every event in `data` at once. Returns a table
+        indexed by (event, team), which is also kept in `event_table`.
+
+        Each event's normal equations are small, so they're built together
+        with one scatter-add over the alliance-matches and each is factored
+        in turn, rather than training one model per event. Groups too large
+        to pad to a common size (see `oprengine.group_oprs`) are solved one
+        at a time from sparse matrices.
+
+        Arguments:
+
+        data -- a dataframe as from `load`, with `teams` and an `event` column.
+
+        y    -- the scores of each alliance-match, as for `train`.
+
+        by   -- the column to group on; any per-row label works, e.g. one
+        combining the event and competition level.
+        """
+        columns, scores = self._targets(y)
+        members = np.array(data.teams.tolist())
+        events, names = pd.factorize(data[by])
+
+        oprs, pairs = oprengine.group_oprs(events, members, scores)
+
+        index = pd.MultiIndex.from_arrays([names[pairs.event], pairs.team], names=[by, 'team'])
+        self.event_table = pd.DataFrame(oprs, index=index, columns=columns)
+        self.event_table.sort_index(inplace=True)
+
+        return self.event_table
+
+
+    @staticmethod
+    def breakdown_targets(data, breakdown, fields=None) -> pd.DataFrame:
+        """
+        Line up the score breakdown of each alliance-match with the rows of
+        `data`. Takes a MatchData frame (one row per robot) and returns one
+        row per alliance-match with a column per field.
+
+        If no fields are given, use every numeric breakdown field, i.e. the
+        columns from lib.headers[year] that follow the standard headers.
+        """
+        if fields is None:
+            start = breakdown.columns.get_loc('winMargin') + 1
+            fields = [c for c in breakdown.columns[start:] if pd.api.types.is_numeric_dtype(breakdown[c])]
+
+        alliances = breakdown.loc[breakdown['Robot Number'] == 1, :].set_index(['Key', 'Alliance'])
+        rows = pd.MultiIndex.from_arrays([data.key, data.index.get_level_values('Alliance')])
+        targets = alliances.loc[:, fields].reindex(rows)
+        targets.index = data.index
+
+        return targets.astype(np.float64)
+
+
+    def train_components(self, data, breakdown, fields=None, by=None) -> pd.DataFrame:
+        """
+        Fit component OPRs for many score breakdown fields at once. The
+        design matrix is factored a single time and every field is solved
+        against the same factorization. Returns a wide table with a column
+        per field, which is also kept in `components`.
+
+        Arguments:
+
+        data      -- a dataframe as from `load`.
+
+        breakdown -- the matching MatchData frame, with a row per robot.
+
+        fields    -- the breakdown fields to solve for; see `breakdown_targets`.
+
+        by        -- fit each event separately (e.g. by='event') rather than
+        the whole of `data`, as in `train_events`.
+        """
+        targets = self.breakdown_targets(data, breakdown, fields)
+        played = targets.notna().all(axis=1).to_numpy()
+        data, targets = data.loc[played, :], targets.loc[played, :]
+
+        if by is not None:
+            self.components = self.train_events(data, targets, by)
+            return self.components
+
+        self.build_sparse_matrix(data)
+        oprs = oprengine.solve_many(self.sparse, targets.to_numpy())
+
+        self.components = pd.DataFrame(oprs, index=pd.Index(self.teams, name='team'), columns=targets.columns)
+        return self.components
+
+
+    def train_metrics(self, data, by=None) -> pd.DataFrame:
+        """
+        Fit OPR, DPR and CCWM together for any slice of match data. DPR solves
+        for the opposing alliance's score and CCWM for the winning margin, and
+        all three are solved against one factorization of the design matrix.
+        Returns a table with a column for each, also kept in `metrics`.
+
+        Arguments:
+
+        data -- a dataframe as from `load`, with both alliances of each match.
+
+        by   -- fit each event separately (e.g. by='event') rather than the
+        whole of `data`, as in `train_events`.
+        """
+        opponent = data.score.groupby(level=0).transform('sum') - data.score
+        targets = pd.DataFrame({
+            'opr': data.score,
+            'dpr': opponent,
+            'ccwm': data.score - opponent,
+        }, index=data.index)
+
+        if by is not None:
+            self.metrics = self.train_events(data, targets, by)
+            return self.metrics
+
+        self.build_sparse_matrix(data)
+        oprs = oprengine.solve_many(self.sparse, targets.to_numpy())
+
+        self.metrics = pd.DataFrame(oprs, index=pd.Index(self.teams, name='team'), columns=targets.columns)
+        return self.metrics
+
+
+    def train_ridge(self, data, y, lam=None, prior=None, by=None, lambdas=None):
+        """
+        Fit ridge-regularized OPRs, which shrink teams with little data toward
+        a prior instead of letting them swing wildly. Returns the OPR table,
+        indexed by team for a season fit, or by (event, team) when fitting per
+        event. `predict` and `export` need a season fit.
+
+        Arguments:
+
+        y       -- a 1-dimensional array of the scores of each alliance-match.
+
+        lam     -- the ridge penalty λ. If not given, the λ from `lambdas`
+        with the lowest leave-one-match-out RMSE is used, and the scores of
+        the whole path are kept in `ridge_cv`.
+
+        prior   -- the OPR to shrink each team toward, as a Series indexed by
+        team, e.g. last season's `table.opr`. Defaults to zero.
+
+        by      -- fit all of `data` at once by default, or each event
+        separately with by='event'. Choosing λ for all of `data` at once needs
+        a dense eigendecomposition over every team, so it's much slower than a
+        fit with a given λ.
+
+        lambdas -- the λ values to choose from. Defaults to 25 values from
+        0.01 to 100, evenly spaced on a log scale.
+        """
+        if lambdas is None:
+            lambdas = np.logspace(-2, 2, 25)
+
+        if by is None and lam is not None:
+            self.build_sparse_matrix(data)
+            mean = np.zeros(len(self.teams)) if prior is None \
+                else prior.reindex(self.teams).fillna(prior.mean()).to_numpy()
+            oprs = oprengine.ridge(self.sparse, y, lam, mean)
+
+            self.lam = lam
+            self.table = pd.DataFrame({ 'opr': oprs }, index=pd.Index(self.teams, name='team'))
+            return self.table
+
+        oprs, self.ridge_cv = oprvalidation.ridge_cv(data, y, [lam] if lam is not None else lambdas, prior, by)
+        self.lam = self.ridge_cv.rmse.idxmin()
+
+        self.table = oprs[[self.lam]].rename(columns={ self.lam: 'opr' })
+        self.table.columns.name = None
+        if by is None:
+            self.table.index = self.table.index.droplevel(0)
+        return self.table
+
+
+    def train_bayes(self, data, y, prior=None, prior_sd=None, noise_sd=None):
+        """
+        Fit OPR as a Bayesian linear model, giving each team a posterior mean
+        and standard deviation. Returns the OPR table with columns opr and sd.
+
+        Arguments:
+
+        y        -- a 1-dimensional array of the scores of each alliance-match.
+
+        prior    -- the prior mean OPR of each team, as a Series indexed by
+        team (e.g. last season's `table.opr`). Teams missing from it get its
+        mean. Defaults to an equal share of the average alliance score.
+
+        prior_sd -- the prior standard deviation of every team's OPR. Defaults
+        to the spread of the least squares OPRs.
+
+        noise_sd -- the standard deviation of an alliance's score about the sum
+        of its OPRs. Defaults to that of the least squares residuals.
+
+        The posterior is kept in `posterior`, and `predict` and `predict_many`
+        use it to give predictive distributions of alliance scores.
+        """
+        self.build_sparse_matrix(data)
+        y = np.asarray(y, dtype=np.float64)
+
+        if prior_sd is None or noise_sd is None:
+            oprs, info = oprengine.solve(self.sparse, y)
+            dof = max(len(y) - len(self.teams), 1)
+            noise_sd = np.sqrt(info['residual']**2 / dof) if noise_sd is None else noise_sd
+            prior_sd = np.std(oprs) if prior_sd is None else prior_sd
+
+        k = np.array(data.teams.tolist()).shape[1] if len(data) else 3
+        mean = np.full(len(self.teams), y.mean() / k if len(y) else 0.0) if prior is None \
+            else prior.reindex(self.teams).fillna(prior.mean()).to_numpy(dtype=np.float64)
+
+        self.posterior = oprengine.GaussianPosterior(self.sparse, y, noise_sd**2, mean, prior_sd**2)
+        self.noise_sd = noise_sd
+
+        self.table = pd.DataFrame({ 'opr': self.posterior.mean, 'sd': np.sqrt(self.posterior.variance) },
+            index=pd.Index(self.teams, name='team'))
+        return self.table
+
+
+    def predict(self, alliance, distribution=False):
+        """
+        Predict the total score for an alliance. With distribution=True, get
+        the normal predictive distribution of its score from the posterior of
+        `train_bayes` instead.
+        """
+        if not distribution:
+            return self.table.loc[alliance, "opr"].sum()
+
+        mean, sd = self.predict_many([alliance])
+        return norm(mean[0], sd[0])
+
+
+    def predict_many(self, alliances):
+        """
+        Get the predictive mean and standard deviation of the score of each
+        alliance in a list, from the posterior of `train_bayes`. The spread
+        covers both the uncertainty in the OPRs and the noise of a match.
+        """
+        if self.posterior is None:
+            raise ValueError("predict_many needs a posterior, from train_bayes")
+
+        members = team_positions(pd.Index(self.teams), np.array([list(a) for a in alliances]))
+
+        mean = self.posterior.mean[members].sum(axis=1)
+        variance = self.posterior.alliance_variance(members) + self.posterior.noise_var
+        return mean, np.sqrt(variance)
+
+
+    def win_probability(self, blue, red, margins, year, week, level) -> np.ndarray:
+        """
+        Get the probability that blue wins each of a batch of matches, from
+        the OPR margin and a `margins.MarginDistributions` of margin errors.
+
+        Arguments:
+
+        blue, red -- lists of the alliances in each match.
+
+        year, week, level -- the year, week and competition level of each
+        match, or one for all of them.
+        """
+        index = pd.Index(self.table.index)
+        opr = self.table.opr.to_numpy(dtype=np.float64)
+        margin = opr[team_positions(index, np.array([list(a) for a in blue]))].sum(axis=1) \
+            - opr[team_positions(index, np.array([list(a) for a in red]))].sum(axis=1)
+        return margins.win_probability(margin, year, week, level)
 
 
     def rank(self):
@@ -414,3 +919,94 @@ class OPRModel:
         self.table.to_csv(filename, columns=columns)
     
 
+
+
+class IncrementalOPR:
+    """
+    OPR that refreshes after every match of a live event.
+
+    Keeps the normal equations AᵀA x = Aᵀy rather than the match data. Each
+    alliance result adds a 3x3 block of ones to AᵀA and its score to three
+    entries of Aᵀy, so an update costs the same however many matches have
+    been played, and solving only depends on the number of teams. Once the
+    system is full rank its Cholesky factor is updated with each result
+    rather than recomputed (see `oprengine.NormalEquations`).
+    """
+
+    def __init__(self, teams=[], targets=('opr',)):
+        self.columns = list(targets)
+        self.index = pd.Index([], name='team')
+        self.system = oprengine.NormalEquations(1, 0, len(self.columns))
+        self.n = 0
+        self._oprs = None
+
+        self.add_teams(teams)
+
+
+    def add_teams(self, teams):
+        """ Add any new teams to the system with no matches played """
+        new = pd.Index(teams).difference(self.index, sort=False)
+        if len(new):
+            self.index = self.index.append(pd.Index(new, name='team'))
+            self.system.add_positions(len(new))
+            self._oprs = None
+
+
+    def update(self, alliance, score):
+        """ Add a single alliance-match result """
+        self.update_many([alliance], [score])
+
+
+    def update_many(self, alliances, scores):
+        """
+        Add a batch of alliance-match results. Takes an Mx3 array of teams and
+        the M scores (or an M x targets array).
+        """
+        members = np.array([list(a) for a in alliances])
+        scores = np.asarray(scores, dtype=np.float64).reshape(len(members), len(self.columns))
+
+        self.add_teams(np.unique(members))
+        p = team_positions(self.index, members)
+
+        self.system.add_rows(np.zeros(len(p), dtype=np.int64), p, scores)
+        self.n += len(members)
+        self._oprs = None
+
+
+    @property
+    def oprs(self) -> np.ndarray:
+        """ Get the current OPRs, one row per team and a column per target """
+        if self._oprs is None:
+            self._oprs = self.system.solve()[0]
+        return self._oprs
+
+
+    @property
+    def G(self) -> np.ndarray:
+        """ Get AᵀA """
+        return self.system.G[0]
+
+
+    @property
+    def b(self) -> np.ndarray:
+        """ Get Aᵀy, with a column per target """
+        return self.system.b[0]
+
+
+    @property
+    def table(self) -> pd.DataFrame:
+        """ Get the current OPR table """
+        return pd.DataFrame(self.oprs, index=self.index, columns=self.columns)
+
+
+    def predict(self, alliance):
+        """ Predict the total score (or targets) for an alliance """
+        total = self.oprs[team_positions(self.index, list(alliance))].sum(axis=0)
+        return total[0] if len(self.columns) == 1 else total
+
+
+    def predict_many(self, alliances) -> np.ndarray:
+        """ Predict the total scores of an Mx3 array of alliances """
+        p = team_positions(self.index, np.array([list(a) for a in alliances]))
+        total = self.oprs[p].sum(axis=1)
+        return total[:, 0] if len(self.columns) == 1 else total
@@ -193,8 +193,19 @@ print("Median (absolute) error:", np.sqrt(np.square(residuals).median()))
 # We might ask, however, whether we can at least predict match outcomes--maybe
 # we can't tell what the margin of victory will be, but at least maybe we can
 # find the victor and a rough sense of their likelihood to win.
+#
+# The residuals above are in-sample: every match helped fit the OPRs it's being
+# judged against. For an honest measure we predict each match with event OPRs
+# fit without it (leave one match out), and with only the matches played
+# before it, as we would during an event. The Brier score rates the win
+# probabilities implied by the predicted margins.
 
 # %%
+import oprvalidation
+
+_, event_data = models.OPRModel.load(pd.read_csv(f"../data/{YEAR}_MatchData_ol.csv"))
+accuracy = oprvalidation.evaluate(event_data)
+accuracy.loc['season']
 
 # %% [markdown]
 # ## Conclusion
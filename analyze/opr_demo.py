@@ -13,8 +13,7 @@ import time
 
 # %% [markdown]
 # Because this model is generalized, it's trivial to calculate world OPRs for
-# all teams. This operation has been optimized significantly, but still takes up
-# to 5 minutes.
+# all teams. The sparse solver fits a whole season in well under a second.
 
 #%%
 # Train Model
@@ -26,7 +25,8 @@ data = pd.read_csv(f"../data/{YEAR}_MatchData_ol.csv")
 teams, train_data = OPRModel.load(data)
 model.train(train_data, train_data.score)
 
-print(f"Time: {int(time.time() - start)} s")
+print(f"Time: {time.time() - start:.2f} s")
+print(model.info)
 model.table.head(10)
 
 # %% [markdown]
@@ -57,6 +57,90 @@ event_data = year_data.loc[year_data.Event==EVENT, :].copy()
 teams, train_data = OPRModel.load(event_data)
 event_model.train(train_data, train_data.score).head()
 
+# %% [markdown]
+# Every event in the season can be solved at once, giving a table of OPRs
+# indexed by event and team.
+
+# %%
+teams, season_data = OPRModel.load(year_data)
+event_oprs = event_model.train_events(season_data, season_data.score)
+event_oprs.loc[EVENT].sort_values('opr', ascending=False).head()
+
+# %% [markdown]
+# DPR and CCWM come from the same factorization, so we can get all three for
+# every event offline, without asking TBA.
+
+# %%
+event_metrics = event_model.train_metrics(season_data, by='event')
+event_metrics.loc[EVENT].sort_values('ccwm', ascending=False).head()
+
+# %% [markdown]
+# Teams with only a few matches can get extreme OPRs. Ridge OPR shrinks each
+# team toward a prior, here their world OPR (last season's would also do), by
+# an amount chosen from a whole path of penalties with leave-one-match-out
+# error.
+
+# %%
+ridge_model = OPRModel()
+ridge_oprs = ridge_model.train_ridge(season_data, season_data.score, prior=model.table.opr, by='event')
+ridge_model.ridge_cv.rmse.plot(logx=True)
+plt.axvline(ridge_model.lam, color='k', linestyle='--')
+plt.title(f"{YEAR} Event OPR Leave-One-Out Error")
+plt.xlabel("Ridge Penalty")
+plt.ylabel("RMSE")
+plt.show()
+
+# %% [markdown]
+# Bayesian OPR gives every team's OPR an uncertainty, and every alliance a
+# predictive distribution of its score rather than a single number.
+
+# %%
+bayes_model = OPRModel()
+bayes_model.train_bayes(season_data, season_data.score, prior=model.table.opr)
+bayes_model.table.sort_values('opr', ascending=False).head(10)
+
+# %%
+alliance = list(season_data.teams.iloc[0])
+bayes_model.predict(alliance, distribution=True).interval(0.9)
+
+# %% [markdown]
+# During an event we can keep OPRs current as each match is played, without
+# retraining on every match so far.
+
+# %%
+from models import IncrementalOPR
+
+live = IncrementalOPR()
+history = []
+for alliance, score in zip(train_data.teams, train_data.score):
+    live.update(alliance, score)
+    history.append(live.table.opr)
+
+history = pd.concat(history, axis=1).T.reset_index(drop=True)
+history[event_model.table.opr.nlargest(5).index].plot()
+plt.title(f"{YEAR}{EVENT} OPR Over the Event")
+plt.xlabel("Alliance-Matches Played")
+plt.ylabel("OPR")
+plt.show()
+
+# %% [markdown]
+# To look at OPR over a window of the season, we can precompute each event's
+# share of the normal equations once. Any window of weeks or set of events is
+# then a sum of blocks and a solve.
+
+# %%
+from oprblocks import OPRBlocks
+
+blocks = OPRBlocks.build(season_data)
+blocks.save(f"data/{YEAR}_opr_blocks")
+
+curves = blocks.rolling(window=2)
+curves.loc[event_model.table.opr.nlargest(5).index].T.plot()
+plt.title(f"{YEAR} Two-Week Rolling OPR")
+plt.xlabel("Week")
+plt.ylabel("OPR")
+plt.show()
+
 # %%
 sns.kdeplot(event_model.table.opr, shade=True)
 plt.title(f"{YEAR}{EVENT} OPR Distribution")
@@ -108,8 +192,7 @@ YEAR = 2019
 EVENT = "necmp"
 FILENAME = f"../data/{YEAR}_MatchData_ol.csv"
 
-panel_model = OPRModel()
-cargo_model = OPRModel()
+component_model = OPRModel()
 
 year_data = pd.read_csv(FILENAME)
 event_data_6 = pd.read_csv(f"../data/{YEAR}_MatchData.csv")
@@ -117,12 +200,11 @@ event_data_6 = pd.read_csv(f"../data/{YEAR}_MatchData.csv")
 event_data = year_data.loc[(year_data.Event==EVENT) & (year_data["Competition Level"]=='qm'), :].copy()
 event_data_6 = event_data_6.loc[(event_data_6.Event==EVENT) & (event_data_6["Competition Level"]=='qm'), :].copy()
 
-event_data_goals = event_data_6.loc[event_data_6["Robot Number"]==1, ["hatchPanelPoints","cargoPoints"]]
-
 teams, train_data = OPRModel.load(event_data)
 
-panel_model.train(train_data, event_data_goals.hatchPanelPoints)
-cargo_model.train(train_data, event_data_goals.cargoPoints)
+# every numeric breakdown field, solved against one factorization
+components = component_model.train_components(train_data, event_data_6)
+components.head()
 
 # %% [markdown]
 # We can visualize this data to see how teams tend to prioritize cargo points
@@ -130,8 +212,8 @@ cargo_model.train(train_data, event_data_goals.cargoPoints)
 # toward one scoring object or another.
 
 # %%
-x = cargo_model.table.opr.sort_index()
-y = panel_model.table.opr.sort_index()
+x = components.cargoPoints
+y = components.hatchPanelPoints
 plt.scatter(x, y)
 plt.title(f"{YEAR}{EVENT} Contributions to Cargo vs Panel Points")
 plt.xlabel("Cargo Points Contribution")
@@ -0,0 +1,171 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import oprengine
+import storage
+
+
+class OPRBlocks:
+    """
+    A season's OPR normal equations, split into one block per event.
+
+    OPR over any set of alliance-matches only needs AᵀA and Aᵀy, and those
+    are sums over the matches. Keeping a sparse block of each for every event
+    means OPR over any window of weeks or subset of events is a sum of blocks
+    and a solve, with no need to go back to the match data. Blocks are keyed
+    by event and week, and can be saved to and memory-mapped from disk.
+    """
+
+    FILES = ['teams', 'weeks', 'rows', 'g_offsets', 'g_i', 'g_j', 'g_value',
+        'b_offsets', 'b_team', 'b_value']
+
+    def __init__(self, teams, events, weeks, rows, g, b, columns=('opr',)):
+        self.teams = np.asarray(teams)
+        self.events = list(events)
+        self.weeks = np.asarray(weeks)
+        self.rows = np.asarray(rows)
+        self.g_offsets, self.g_i, self.g_j, self.g_value = g
+        self.b_offsets, self.b_team, self.b_value = b
+        self.columns = list(columns)
+
+
+    @classmethod
+    def build(cls, data, y=None):
+        """
+        Build the blocks of every event in `data` (as from `OPRModel.load`).
+        Solves for the score by default, or for each column of y.
+        """
+        if y is None:
+            y = data.score
+        columns = list(y.columns) if isinstance(y, pd.DataFrame) else \
+            ['opr'] if np.ndim(y) == 1 else list(range(np.shape(y)[1]))
+        y = np.asarray(y, dtype=np.float64).reshape(len(data), -1)
+
+        members = np.array(data.teams.tolist())
+        teams, p = np.unique(members, return_inverse=True)
+        p = p.reshape(members.shape)
+        T = len(teams)
+
+        # blocks in the order the events were played: by week, then by the
+        # order their first matches appear
+        codes, names = pd.factorize(data.event)
+        first = data.week.groupby(codes).min().to_numpy()
+        order = np.lexsort((np.arange(len(names)), first))
+        blocks = np.argsort(order)[codes]
+        events, weeks = names[order], first[order]
+        rows = np.bincount(blocks, minlength=len(events))
+
+        # AᵀA entries, summed within each block
+        k = members.shape[1]
+        keys = (blocks[:, None, None] * T + p[:, :, None]) * T + p[:, None, :]
+        g_keys, g_value = np.unique(keys.ravel(), return_counts=True)
+        g_block, g_cell = np.divmod(g_keys, T * T)
+        g = (np.searchsorted(g_block, np.arange(len(events) + 1)), *np.divmod(g_cell, T),
+            g_value.astype(np.float64))
+
+        # Aᵀy entries
+        keys = (blocks[:, None] * T + p).ravel()
+        b_keys, inverse = np.unique(keys, return_inverse=True)
+        b_value = np.zeros((len(b_keys), y.shape[1]))
+        np.add.at(b_value, inverse, np.repeat(y, k, axis=0))
+        b_block, b_team = np.divmod(b_keys, T)
+        b = (np.searchsorted(b_block, np.arange(len(events) + 1)), b_team, b_value)
+
+        return cls(teams, events, weeks, rows, g, b, columns)
+
+
+    def select(self, weeks=None, events=None) -> np.ndarray:
+        """ Get the block numbers within a range of weeks and/or a set of events """
+        mask = np.ones(len(self.events), dtype=bool)
+        if weeks is not None:
+            mask &= np.isin(self.weeks, list(weeks))
+        if events is not None:
+            mask &= np.isin(np.array(self.events), list(events))
+        return np.flatnonzero(mask)
+
+
+    def normal_equations(self, blocks):
+        """ Sum the given blocks into a sparse AᵀA and a dense Aᵀy over every team """
+        g = np.concatenate([np.arange(self.g_offsets[i], self.g_offsets[i+1]) for i in blocks] or [[]]).astype(np.int64)
+        b = np.concatenate([np.arange(self.b_offsets[i], self.b_offsets[i+1]) for i in blocks] or [[]]).astype(np.int64)
+
+        T = len(self.teams)
+        G = sp.csr_matrix((self.g_value[g], (self.g_i[g], self.g_j[g])), shape=(T, T))
+        rhs = np.zeros((T, len(self.columns)))
+        np.add.at(rhs, self.b_team[b], self.b_value[b])
+
+        return G, rhs
+
+
+    def solve(self, weeks=None, events=None, blocks=None, x0=None) -> pd.DataFrame:
+        """
+        Get OPRs over a window of weeks and/or a set of events (or a list of
+        block numbers). Only teams that played in the window are returned.
+        """
+        if blocks is None:
+            blocks = self.select(weeks, events)
+        G, rhs = self.normal_equations(blocks)
+        played = np.flatnonzero(G.diagonal() > 0)
+
+        G = G[played][:, played]
+        if len(played) <= oprengine.DENSE_TEAMS:
+            oprs = oprengine.solve_normal(G.toarray(), rhs[played])
+        else:
+            start = np.zeros((len(played), len(self.columns))) if x0 is None else x0.reindex(self.teams[played]).fillna(0).to_numpy()
+            oprs = oprengine.cg(lambda v: G @ v, rhs[played], start)[0]
+
+        return pd.DataFrame(oprs, index=pd.Index(self.teams[played], name='team'), columns=self.columns)
+
+
+    def rolling(self, window=None, column=None) -> pd.DataFrame:
+        """
+        Get each team's OPR after every week of the season, over the last
+        `window` weeks or, by default, every week so far. Returns a team x
+        week table of one target.
+        """
+        column = self.columns[0] if column is None else column
+        curves = {}
+        previous = None
+        for week in np.unique(self.weeks):
+            first = -np.inf if window is None else week - window + 1
+            weeks = self.weeks[(self.weeks >= first) & (self.weeks <= week)]
+            previous = self.solve(weeks=np.unique(weeks), x0=previous)
+            curves[week] = previous[column]
+
+        table = pd.DataFrame(curves)
+        table.columns.name = 'week'
+        return table
+
+
+    def recent(self, k=2) -> pd.DataFrame:
+        """
+        Get each team's OPR from only its last k events, by week. Teams that
+        share the same last k events share a solve.
+        """
+        block = np.repeat(np.arange(len(self.events)), np.diff(self.b_offsets))
+        block_teams = pd.DataFrame({ 'block': block, 'week': self.weeks[block], 'team': self.b_team }) \
+            .sort_values(['team', 'week', 'block'])
+        last = block_teams.groupby('team').block.apply(lambda b: tuple(b.to_numpy()[-k:]))
+
+        tables = []
+        for blocks, teams in last.groupby(last).groups.items():
+            oprs = self.solve(blocks=list(blocks))
+            tables.append(oprs.loc[self.teams[np.asarray(teams)], :])
+
+        return pd.concat(tables).sort_index()
+
+
+    def save(self, path):
+        """ Write the blocks to a directory of .npy files """
+        storage.save_arrays(path, { name: getattr(self, name) for name in self.FILES },
+            { 'events': self.events, 'columns': self.columns })
+
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """ Load saved blocks, memory-mapping their arrays by default """
+        arrays, meta = storage.load_arrays(path, mmap_mode)
+        g = tuple(arrays[name] for name in ['g_offsets', 'g_i', 'g_j', 'g_value'])
+        b = tuple(arrays[name] for name in ['b_offsets', 'b_team', 'b_value'])
+
+        return cls(arrays['teams'], meta['events'], arrays['weeks'], arrays['rows'], g, b, meta['columns'])
@@ -0,0 +1,291 @@
+"""
+Out-of-sample accuracy of event OPR.
+
+In-sample residuals flatter OPR, since every match helped fit the OPRs it is
+judged against. This harness scores OPR two honest ways, for every event in
+a season at once:
+
+- Leave one match out. Each match is predicted from OPRs fit to the rest of
+  its event. This needs no refitting: with H = A (AᵀA)⁻¹ Aᵀ, the held out
+  residuals of a match's two rows S are (I - H_SS)⁻¹ e_S, where e are the
+  ordinary residuals.
+
+- Predict the next match. Each event is replayed in order and every match is
+  predicted from the matches before it, updating each event's normal
+  equations and their Cholesky factor as results come in.
+
+Scores are judged by MAE and RMSE per alliance-match, and the predicted
+margins by the Brier score of the win probability they imply.
+"""
+
+import oprengine
+from scipy.special import ndtr
+import pandas as pd
+import numpy as np
+
+
+# the order competition levels are played in
+LEVELS = { 'qm': 0, 'ef': 1, 'qf': 2, 'sf': 3, 'f': 4 }
+
+
+def _play_order(keys) -> np.ndarray:
+    """
+    Sort match keys (e.g. 2017casj_qf2m1) into the order they were played
+    within their events: by competition level, then set, then match, the
+    same order `sort_data` uses. Keys that don't parse go last, in the order
+    given.
+    """
+    parts = pd.Series(np.asarray(keys, dtype=str)).str.extract(r"_(qm|ef|qf|sf|f)(\d+)(?:m(\d+))?$")
+    level = parts[0].map(LEVELS).to_numpy(dtype=np.float64)
+    number = parts[[1, 2]].apply(pd.to_numeric).to_numpy(dtype=np.float64)
+
+    # qualification keys only number the match
+    qm = (parts[0] == 'qm').to_numpy()
+    set_number = np.where(qm, 1, number[:, 0])
+    match_number = np.where(qm, number[:, 0], number[:, 1])
+
+    return np.lexsort((np.arange(len(parts)), match_number, set_number, level))
+
+
+def _layout(data, by):
+    """
+    Get the team positions, event codes and blue/red row pairs of `data`.
+    With by=None all of `data` is treated as a single event.
+    """
+    members = np.array(data.teams.tolist())
+    groups = data[by] if by is not None else pd.Series('season', index=data.index)
+    events, names = pd.factorize(groups)
+    local, n, _ = oprengine.event_positions(events, members)
+
+    rows = pd.Series(np.arange(len(data)), index=data.index)
+    blue = rows.xs('blue', level='Alliance')
+    red = rows.xs('red', level='Alliance').reindex(blue.index)
+    played = red.notna().to_numpy()
+    matches = np.column_stack([blue.to_numpy()[played], red.to_numpy()[played].astype(np.int64)])
+
+    return events, names, local, n, matches
+
+
+def _held_out(y, resid, matches, h_bb, h_rr, h_br):
+    """
+    Turn the residuals of a fit into held out predictions, by inverting
+    I - H_SS for each match's 2x2 block of the hat matrix.
+    """
+    blue, red = matches[..., 0], matches[..., 1]
+    a, d, c = 1 - h_bb, 1 - h_rr, -h_br
+    det = a * d - c**2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        det = np.where(np.abs(det) > 1e-9, det, np.nan)
+        e_blue = (d * resid[..., blue] - c * resid[..., red]) / det
+        e_red = (a * resid[..., red] - c * resid[..., blue]) / det
+
+    predicted = np.full(resid.shape, np.nan)
+    predicted[..., blue] = y[blue] - e_blue
+    predicted[..., red] = y[red] - e_red
+
+    return predicted
+
+
+def loo_predictions(data, by='event') -> np.ndarray:
+    """
+    Get the leave-one-match-out predicted score of each alliance-match in
+    `data` (as from `OPRModel.load`), fitting OPR within each event. Matches
+    whose teams play nowhere else in the event can't be predicted and get NaN.
+    """
+    events, names, local, n, matches = _layout(data, by)
+    y = data.score.to_numpy(dtype=np.float64)
+
+    G = np.zeros((len(names), n, n))
+    b = np.zeros((len(names), n, 1))
+    oprengine.add_rows(G, b, events, local, y[:, None])
+    P = oprengine.pseudo_inverse(G)
+    x = (P @ b)[..., 0]
+
+    e = events[:, None]
+    resid = y - x[e, local].sum(axis=1)
+
+    def hat(r, s):
+        # entry of A (AᵀA)⁻¹ Aᵀ between rows r and s of the same event
+        return P[events[r][:, None, None], local[r][:, :, None], local[s][:, None, :]].sum(axis=(1, 2))
+
+    blue, red = matches[:, 0], matches[:, 1]
+    return _held_out(y, resid, matches, hat(blue, blue), hat(red, red), hat(blue, red))
+
+
+def ridge_path(data, y, lambdas, prior=None, by='event', chunk=1 << 22):
+    """
+    Fit ridge-regularized OPR, minimizing |Ax - y|² + λ|x - prior|², for a
+    whole path of λ with one eigendecomposition of AᵀA, and get the leave-
+    one-match-out predictions of every fit from the same decomposition.
+
+    Arguments:
+
+    y       -- the score of each alliance-match in `data`.
+
+    lambdas -- the λ values to fit, all positive.
+
+    prior   -- the OPR each team is shrunk toward, as a Series indexed by team
+    (e.g. last season's OPRs). Teams missing from it get its mean. Defaults
+    to zero.
+
+    by      -- fit each event separately, or all of `data` at once with
+    by=None. A single fit needs a dense eigendecomposition over every team.
+
+    Returns the OPRs (one row per (event, team) and a column per λ) and a
+    len(lambdas) x R array of held out predictions.
+    """
+    lambdas = np.asarray(lambdas, dtype=np.float64)
+    members = np.array(data.teams.tolist())
+    events, names, local, n, matches = _layout(data, by)
+    _, _, pairs = oprengine.event_positions(events, members)
+    y = np.asarray(y, dtype=np.float64)
+
+    # shrinking toward the prior is ridge on what the prior doesn't explain
+    mean = np.zeros((len(names), n))
+    if prior is not None:
+        mean[pairs.event, pairs.position] = prior.reindex(pairs.team).fillna(prior.mean()).to_numpy()
+    offset = mean[events[:, None], local].sum(axis=1)
+
+    G = np.zeros((len(names), n, n))
+    b = np.zeros((len(names), n, 1))
+    oprengine.add_rows(G, b, events, local, (y - offset)[:, None])
+    w, V = np.linalg.eigh(G)
+    c = (np.swapaxes(V, -1, -2) @ b)[..., 0]
+
+    # every fit of the path, as λ x event x position
+    d = 1 / (w[None] + lambdas[:, None, None])
+    x = mean + np.einsum('eij,lej->lei', V, d * c)
+
+    oprs = pd.DataFrame(x[:, pairs.event, pairs.position].T, columns=pd.Index(lambdas, name='lambda'),
+        index=pd.MultiIndex.from_arrays([names[pairs.event], pairs.team], names=[by or 'group', 'team']))
+
+    # hat matrix entries from the rows' projections onto the eigenvectors
+    residuals = y - x[:, events[:, None], local].sum(axis=2)
+    predicted = np.full((len(lambdas), len(y)), np.nan)
+    step = max(1, chunk // (len(lambdas) * max(n, 1)))
+    for start in range(0, len(matches), step):
+        m = matches[start:start + step]
+        e = events[m[:, 0]]
+        U_b = V[e[:, None], local[m[:, 0]], :].sum(axis=1)
+        U_r = V[e[:, None], local[m[:, 1]], :].sum(axis=1)
+        D = d[:, e, :]
+
+        h_bb = (D * U_b**2).sum(axis=2)
+        h_rr = (D * U_r**2).sum(axis=2)
+        h_br = (D * U_b * U_r).sum(axis=2)
+
+        rows = np.arange(2 * len(m)).reshape(-1, 2)
+        held = _held_out(y[m.ravel()], residuals[:, m.ravel()], rows, h_bb, h_rr, h_br)
+        predicted[:, m.ravel()] = held
+
+    return oprs, predicted
+
+
+def ridge_cv(data, y, lambdas, prior=None, by='event'):
+    """
+    Score a path of ridge λ by leave-one-match-out error. Returns the OPRs
+    of every λ (as from `ridge_path`) and a table of MAE and RMSE per λ.
+    """
+    oprs, predicted = ridge_path(data, y, lambdas, prior, by)
+    error = predicted - np.asarray(y, dtype=np.float64)
+
+    table = pd.DataFrame({
+        'n': np.isfinite(error).sum(axis=1),
+        'mae': np.nanmean(np.abs(error), axis=1),
+        'rmse': np.sqrt(np.nanmean(error**2, axis=1)),
+    }, index=pd.Index(lambdas, name='lambda'))
+
+    return oprs, table
+
+
+def next_match_predictions(data, by='event') -> np.ndarray:
+    """
+    Get the predicted score of each alliance-match in `data` from the OPRs of
+    the matches before it at the same event. The matches are put in the order
+    they were played from their keys, whatever order `data` is in. The first
+    matches of an event predict unseen teams at zero.
+    """
+    events, names, local, n, matches = _layout(data, by)
+    y = data.score.to_numpy(dtype=np.float64)
+
+    # the number of matches each event had played before this one
+    matches = matches[_play_order(data.key.to_numpy()[matches[:, 0]])]
+    played = pd.Series(events[matches[:, 0]]).groupby(events[matches[:, 0]]).cumcount().to_numpy()
+
+    system = oprengine.NormalEquations(len(names), n)
+    predicted = np.full(len(y), np.nan)
+
+    for k in range(played.max() + 1 if len(played) else 0):
+        rows = matches[played == k].ravel()
+        active, slot = np.unique(events[rows], return_inverse=True)
+
+        x = system.solve(active)[..., 0]
+        predicted[rows] = x[slot[:, None], local[rows]].sum(axis=1)
+
+        system.add_rows(events[rows], local[rows], y[rows])
+
+    return predicted
+
+
+def score(data, predicted, by='event', scale=None, margins=None) -> pd.DataFrame:
+    """
+    Summarize predicted scores per event and for the whole of `data`.
+
+    The win probability of each match is P(margin > 0) for a normal margin
+    centred on the predicted margin, with standard deviation `scale`. If no
+    scale is given it's taken from the margin errors themselves. Given a
+    `margins.MarginDistributions` of margin errors, its empirical CDFs are
+    used instead of the normal.
+
+    Returns the number of predicted alliance-matches, MAE, RMSE and win
+    Brier score of each event, with a final 'season' row.
+    """
+    events, names, _, _, matches = _layout(data, by)
+    y = data.score.to_numpy(dtype=np.float64)
+    blue, red = matches[:, 0], matches[:, 1]
+
+    margin = y[blue] - y[red]
+    predicted_margin = predicted[blue] - predicted[red]
+    valid = np.isfinite(predicted_margin)
+
+    if margins is not None:
+        key = data.key.iloc[blue]
+        level = key.str.extract(r"_(qm|qf|sf|f)\d", expand=False).to_numpy()
+        p = margins.win_probability(predicted_margin, key.str[:4].astype(int), data.week.iloc[blue], level)
+    else:
+        if scale is None:
+            scale = np.sqrt(np.mean((predicted_margin[valid] - margin[valid])**2))
+        p = ndtr(predicted_margin / scale)
+    outcome = np.where(margin > 0, 1.0, np.where(margin < 0, 0.0, 0.5))
+
+    rows = pd.DataFrame({
+        'event': names[events[blue]],
+        'n': 2 * valid,
+        'abs': np.abs(predicted[blue] - y[blue]) + np.abs(predicted[red] - y[red]),
+        'sq': (predicted[blue] - y[blue])**2 + (predicted[red] - y[red])**2,
+        'matches': valid,
+        'brier': (p - outcome)**2,
+    }).loc[valid, :]
+
+    sums = rows.groupby('event').sum()
+    sums.loc['season'] = rows.drop('event', axis=1).sum()
+
+    table = pd.DataFrame({
+        'n': sums.n.astype(np.int64),
+        'mae': sums['abs'] / sums.n,
+        'rmse': np.sqrt(sums.sq / sums.n),
+        'brier': sums.brier / sums.matches,
+    })
+    table.index.name = by
+
+    return table
+
+
+def evaluate(data, by='event', scale=None, margins=None) -> pd.DataFrame:
+    """
+    Score leave-one-match-out and next-match OPR predictions for every event
+    in `data`, side by side.
+    """
+    loo = score(data, loo_predictions(data, by), by, scale, margins)
+    ahead = score(data, next_match_predictions(data, by), by, scale, margins)
+    return pd.concat([loo, ahead], axis=1, keys=['loo', 'next'])
@@ -0,0 +1,190 @@
+"""
+Resumable multi-year training for the rating models.
+
+Each season's model is checkpointed in the binary model format after it
+trains, along with a hash of the data it trained on and the model parameters.
+Running the pipeline again only retrains from the first season whose data or
+parameters have changed, so editing the 2020 data retrains 2020 alone.
+
+Example: python pipeline.py ts 2005 2020 --export
+"""
+
+import models
+from models import EloModel, TSModel
+from evaluation import Evaluator
+from history import RatingHistory
+import pandas as pd
+import numpy as np
+import argparse
+import hashlib
+import json
+import time
+import os
+
+MANIFEST = "manifest.json"
+
+
+def file_hash(filename) -> str:
+    """ Get the sha256 hash of a file's contents """
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def load_season(filename) -> pd.DataFrame:
+    """ Read a MatchData_ol file and prepare it for training """
+    data = pd.read_csv(filename)
+    data = models.process_data(data)
+    data = models.sort_data(data)
+    return data
+
+
+def build_model(kind, params):
+    """ Construct an untrained model of the given kind """
+    if kind == 'elo':
+        return EloModel(k=params['k'], n=params['n'], i=params['i'],
+            logging=params['logging'], history=params['history'])
+
+    env = models.ts.setup(mu=params['mu'], sigma=params['sigma'], beta=params['beta'],
+        tau=params['tau'], draw_probability=params['draw'])
+    return TSModel(env=env, logging=params['logging'], history=params['history'])
+
+
+def train_season(model, data):
+    """ Train a model on one season of processed match data """
+    model.add_teams(np.unique(np.array(data.blue.tolist() + data.red.tolist())))
+
+    model.train_many(data)
+
+
+def save_checkpoint(model, directory, **metadata):
+    """ Save a model, with its evaluator and history, to a checkpoint directory """
+    os.makedirs(directory, exist_ok=True)
+    model.save(os.path.join(directory, "model.npz"), **metadata)
+
+    if model.evaluator is not None:
+        model.evaluator.save(os.path.join(directory, "evaluator.npz"))
+    if model.history is not None:
+        model.history.save(os.path.join(directory, "history"))
+
+
+def load_checkpoint(directory, params):
+    """ Load a model saved with `save_checkpoint` """
+    model = models.load_model(os.path.join(directory, "model.npz"))
+
+    if params['logging']:
+        model.evaluator = Evaluator.load(os.path.join(directory, "evaluator.npz"))
+    if params['history']:
+        model.history = RatingHistory.load(os.path.join(directory, "history"))
+
+    return model
+
+
+def run(kind, years, params, data_dir="../data", checkpoint_dir="checkpoints", export_dir=None):
+    """
+    Train a model over a range of years, resuming from the latest checkpoint
+    that is still valid. Returns the trained model.
+    """
+    directory = os.path.join(checkpoint_dir, kind)
+    os.makedirs(directory, exist_ok=True)
+
+    manifest_file = os.path.join(directory, MANIFEST)
+    manifest = { 'params': None, 'seasons': {} }
+    if os.path.exists(manifest_file):
+        with open(manifest_file, 'r') as f:
+            manifest = json.load(f)
+
+    # drop every checkpoint if the parameters changed
+    if manifest['params'] != params:
+        manifest = { 'params': params, 'seasons': {} }
+
+    data_files = { y: os.path.join(data_dir, f"{y}_MatchData_ol.csv") for y in years }
+    hashes = { y: file_hash(data_files[y]) for y in years }
+
+    # find the first season that needs to be retrained
+    start = 0
+    for year in years:
+        entry = manifest['seasons'].get(str(year))
+        if entry is None or entry['hash'] != hashes[year] \
+            or not os.path.exists(os.path.join(directory, entry['checkpoint'])):
+            break
+        start += 1
+
+    if start > 0:
+        previous = manifest['seasons'][str(years[start-1])]
+        model = load_checkpoint(os.path.join(directory, previous['checkpoint']), params)
+        print(f"Resuming from {years[start-1]} checkpoint")
+    else:
+        model = build_model(kind, params)
+
+    # later checkpoints were built on seasons that are about to change
+    if start < len(years):
+        manifest['seasons'] = { y: e for y,e in manifest['seasons'].items() if int(y) < years[start] }
+
+    for year in years[start:]:
+        data = load_season(data_files[year])
+
+        print(f"Year: {year}")
+        print(f"Simulating {len(data)} matches")
+        substart = time.time()
+
+        train_season(model, data)
+
+        print(f"Training time: {time.time() - substart:.1f} s")
+        print("=" * 35)
+
+        checkpoint = str(year)
+        save_checkpoint(model, os.path.join(directory, checkpoint), year=year, data_hash=hashes[year])
+        manifest['seasons'][str(year)] = { 'hash': hashes[year], 'checkpoint': checkpoint }
+
+        with open(manifest_file, 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+        if export_dir is not None:
+            model.export(os.path.join(export_dir, f"{year}_end_{kind}.csv"))
+
+    return model
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train a rating model over a range of years.")
+    parser.add_argument('model', choices=['elo','ts'], help="Model to train")
+    parser.add_argument('start', type=int, help="First year to train on")
+    parser.add_argument('end', type=int, help="Last year to train on")
+    parser.add_argument('--data', type=str, default="../data", help="Directory of MatchData_ol files")
+    parser.add_argument('--checkpoints', type=str, default="checkpoints", help="Checkpoint directory")
+    parser.add_argument('--export', type=str, nargs='?', const="data", default=None,
+        help="Export end-of-year ratings to this directory (default: data)")
+    parser.add_argument('--history', action='store_true', help="Record weekly rating snapshots")
+    parser.add_argument('--no-logging', dest='logging', action='store_false',
+        help="Don't evaluate predictions during training")
+
+    parser.add_argument('-k', type=float, default=30, help="Elo K factor")
+    parser.add_argument('-n', type=float, default=400, help="Elo N factor")
+    parser.add_argument('-i', type=float, default=1000, help="Elo initial rating")
+
+    parser.add_argument('--mu', type=float, default=1000, help="TrueSkill initial mu")
+    parser.add_argument('--sigma', type=float, default=100, help="TrueSkill initial sigma")
+    parser.add_argument('--beta', type=float, default=100, help="TrueSkill beta")
+    parser.add_argument('--tau', type=float, default=10, help="TrueSkill tau")
+    parser.add_argument('--draw', type=float, default=.01, help="TrueSkill draw probability")
+
+    args = parser.parse_args()
+
+    if args.model == 'elo':
+        params = { 'k': args.k, 'n': args.n, 'i': args.i }
+    else:
+        params = { 'mu': args.mu, 'sigma': args.sigma, 'beta': args.beta,
+            'tau': args.tau, 'draw': args.draw }
+    params.update({ 'logging': args.logging, 'history': args.history })
+
+    years = list(range(args.start, args.end + 1))
+
+    start = time.time()
+    model = run(args.model, years, params, args.data, args.checkpoints, args.export)
+    print(f"Total time: {int(time.time() - start)} s")
+
+    if model.evaluator is not None:
+        print(model.evaluator.summary())
@@ -0,0 +1,230 @@
+import numpy as np
+import pandas as pd
+import storage
+import os
+
+
+class TeamProfiles:
+    """
+    Per-team distributions of the score breakdown fields of a season.
+
+    Built from a MatchData frame (one row per robot), in one pass: the rows
+    are sorted by team, week and event a single time, so every team, every
+    (team, week) and every (team, event) is a contiguous block, and counts,
+    means, standard deviations and quantiles of all fields come from
+    vectorized reductions over the blocks. The sorted values are kept too,
+    so the raw samples behind any profile are a slice.
+    """
+
+    LEVELS = { 'team': ['Team'], 'week': ['Team', 'Week'], 'event': ['Team', 'Event'] }
+    QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+
+    def __init__(self, fields, quantiles, keys, values, levels):
+        """
+        Arguments:
+
+        fields    -- the profiled breakdown fields.
+
+        quantiles -- the quantiles kept for every field.
+
+        keys      -- the Team, Week and Event of each row, in sorted order.
+
+        values    -- the field values of each row, in the same order.
+
+        levels    -- for each of LEVELS, the first row of each block and a
+        stat x block x field array of its summaries.
+        """
+        self.fields = list(fields)
+        self.quantiles = list(quantiles)
+        self.keys = keys
+        self.values = values
+        self.levels = levels
+
+        self.tables = { level: self._table(columns, *levels[level]) for level, columns in self.LEVELS.items() }
+        self.teams = np.asarray(self.tables['team'].index)
+
+
+    @property
+    def stats(self) -> list:
+        return ['count', 'mean', 'std'] + [f"q{round(100 * q)}" for q in self.quantiles]
+
+
+    @classmethod
+    def build(cls, data, fields=None, quantiles=QUANTILES):
+        """
+        Profile every team in a MatchData frame. If no fields are given, use
+        every numeric breakdown field, i.e. the columns that follow the
+        standard headers (including any derived columns added after them).
+        """
+        if fields is None:
+            start = data.columns.get_loc('winMargin') + 1
+            fields = [c for c in data.columns[start:] if pd.api.types.is_numeric_dtype(data[c])]
+
+        order = np.lexsort((data.Event.to_numpy(), data.Week.to_numpy(), data.Team.to_numpy()))
+        keys = data.loc[:, ['Team', 'Week', 'Event']].iloc[order].reset_index(drop=True)
+        values = data.loc[:, fields].to_numpy(dtype=np.float64)[order]
+
+        levels = {}
+        for level, columns in cls.LEVELS.items():
+            starts = cls._starts(keys, columns)
+            levels[level] = (starts, cls._aggregate(values, starts, quantiles))
+
+        return cls(fields, quantiles, keys, values.astype(np.float32), levels)
+
+
+    @staticmethod
+    def _starts(keys, columns) -> np.ndarray:
+        """ Get the first row of each block of sorted rows that share the given keys """
+        change = np.zeros(len(keys), dtype=bool)
+        change[:1] = True
+        for c in columns:
+            k = keys[c].to_numpy()
+            change[1:] |= k[1:] != k[:-1]
+        return np.flatnonzero(change)
+
+
+    @staticmethod
+    def _aggregate(values, starts, quantiles) -> np.ndarray:
+        """
+        Summarize every block of rows for every field. Returns a stat x block x
+        field array of the count, mean, standard deviation and quantiles.
+        """
+        stats = np.full((3 + len(quantiles), len(starts), values.shape[1]), np.nan)
+        if not len(starts):
+            return stats
+        sizes = np.diff(np.append(starts, len(values)))
+        block = np.repeat(np.arange(len(starts)), sizes)
+
+        finite = np.isfinite(values)
+        count = np.add.reduceat(finite, starts, axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.add.reduceat(np.where(finite, values, 0), starts, axis=0) / count
+            deviation = np.where(finite, values - mean[block], 0)
+            stats[2] = np.sqrt(np.add.reduceat(deviation**2, starts, axis=0) / (count - 1))
+        stats[0], stats[1] = count, mean
+
+        # quantiles interpolate between the sorted finite values of each block
+        last = starts + sizes - 1
+        for f in range(values.shape[1]):
+            v = values[np.lexsort((values[:, f], block)), f]
+            for i, q in enumerate(quantiles):
+                position = starts + q * (count[:, f] - 1)
+                lo = np.clip(np.floor(position).astype(np.int64), starts, last)
+                hi = np.clip(np.ceil(position).astype(np.int64), starts, last)
+                stats[3 + i, :, f] = np.where(count[:, f] > 0, v[lo] + (position - lo) * (v[hi] - v[lo]), np.nan)
+
+        return stats
+
+
+    def _table(self, columns, starts, stats) -> pd.DataFrame:
+        """ Lay out one level's summaries as a block x (stat, field) table """
+        if len(columns) > 1:
+            index = pd.MultiIndex.from_frame(self.keys.loc[starts, columns].reset_index(drop=True))
+        else:
+            index = pd.Index(self.keys[columns[0]].to_numpy()[starts], name=columns[0])
+
+        frames = [pd.DataFrame(s.astype(np.int32 if name == 'count' else np.float32), index=index, columns=self.fields)
+            for name, s in zip(self.stats, stats)]
+        return pd.concat(frames, axis=1, keys=self.stats)
+
+
+    def table(self, level='team', stat='mean') -> pd.DataFrame:
+        """ Get one statistic of every field, for every team or (team, week) or (team, event) """
+        return self.tables[level][stat]
+
+
+    def lookup(self, team, week=None, event=None) -> pd.DataFrame:
+        """ Get a stat x field summary of one team, overall or in a week or event """
+        if week is not None:
+            row = self.tables['week'].loc[(team, week)]
+        elif event is not None:
+            row = self.tables['event'].loc[(team, event)]
+        else:
+            row = self.tables['team'].loc[team]
+        return row.unstack().loc[self.stats, self.fields]
+
+
+    def samples(self, team, week=None, event=None) -> pd.DataFrame:
+        """ Get the raw field values behind one of the team's profiles """
+        teams = self.keys.Team.to_numpy()
+        lo, hi = np.searchsorted(teams, team, side='left'), np.searchsorted(teams, team, side='right')
+        rows = self.keys.iloc[lo:hi]
+
+        keep = np.ones(len(rows), dtype=bool)
+        if week is not None:
+            keep &= rows.Week.to_numpy() == week
+        if event is not None:
+            keep &= rows.Event.to_numpy() == event
+
+        return pd.DataFrame(self.values[rows.index[keep]], columns=self.fields, index=rows.index[keep])
+
+
+    def summary(self, weeks=None, stat='mean') -> pd.DataFrame:
+        """
+        Get each team's count, mean or standard deviation of every field,
+        pooled over a set of weeks from the weekly profiles.
+        """
+        weekly = self.tables['week']
+        if weeks is not None:
+            weekly = weekly.loc[weekly.index.get_level_values('Week').isin(list(weeks)), :]
+
+        count = weekly['count'].astype(np.float64)
+        total = (count * weekly['mean']).fillna(0).groupby(level='Team').sum()
+        n = count.groupby(level='Team').sum()
+        if stat == 'count':
+            return n.astype(np.int64)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = total / n
+            if stat == 'mean':
+                return mean
+
+            # within-week and between-week sums of squares
+            within = ((count - 1) * weekly['std']**2).fillna(0).groupby(level='Team').sum()
+            between = (count * (weekly['mean'] - mean.reindex(weekly.index, level='Team'))**2).fillna(0) \
+                .groupby(level='Team').sum()
+            return np.sqrt((within + between) / (n - 1))
+
+
+    def save(self, path):
+        """ Write the profiles to a directory of .npy files """
+        arrays = { 'values': self.values }
+        arrays.update({ f"key_{column}": self.keys[column].to_numpy() for column in self.keys.columns })
+        for level, (starts, stats) in self.levels.items():
+            arrays[f"{level}_starts"] = starts
+            arrays[f"{level}_stats"] = stats.astype(np.float32)
+
+        storage.save_arrays(path, arrays, { 'fields': self.fields, 'quantiles': self.quantiles })
+
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        """ Load profiles saved with `save` """
+        arrays, meta = storage.load_arrays(path, mmap_mode)
+
+        keys = pd.DataFrame({ c: arrays[f"key_{c}"] for c in ['Team', 'Week', 'Event'] })
+        levels = { level: (arrays[f"{level}_starts"], arrays[f"{level}_stats"]) for level in cls.LEVELS }
+
+        return cls(meta['fields'], meta['quantiles'], keys, arrays['values'], levels)
+
+
+    @classmethod
+    def from_csv(cls, filename, path=None, fields=None, prepare=None):
+        """
+        Profile a MatchData csv, caching the result. The cache (by default a
+        directory next to the csv) is reused until the csv changes.
+
+        prepare -- optional function applied to the frame before profiling,
+        e.g. to add derived columns.
+        """
+        path = path or os.path.splitext(filename)[0] + "_profiles"
+        if storage.is_fresh(path, [filename]):
+            return cls.load(path)
+
+        data = pd.read_csv(filename)
+        if prepare is not None:
+            data = prepare(data)
+        profiles = cls.build(data, fields)
+        profiles.save(path)
+
+        return profiles
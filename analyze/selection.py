@@ -0,0 +1,228 @@
+"""
+Alliance selection optimizer.
+
+Given the teams at an event, the alliance captains in seed order and a trained
+TSModel or EloModel, search for the picks that give one captain's alliance the
+best chance to win the elimination bracket. Every other captain is assumed to
+pick greedily, taking the strongest team left on the board, and picks go in
+the usual serpentine order.
+
+The search maximizes a lower bound on our chance of winning: the product over
+rounds of our series odds against the toughest alliance we could meet. The
+alliances it finds are then scored by simulating the bracket against the
+field the greedy draft leaves.
+"""
+
+from models import TSModel, team_positions
+from simulate import bracket_order, series, simulate_bracket
+from scipy.special import ndtr
+import pandas as pd
+import numpy as np
+import heapq
+
+
+class AllianceOptimizer:
+
+    def __init__(self, model, teams, captains, picks=2, size=3):
+        """
+        Arguments:
+
+        model    -- a trained TSModel or EloModel.
+
+        teams    -- every team at the event.
+
+        captains -- the alliance captains in seed order. The number of
+        captains must be a power of two.
+
+        picks    -- number of picks per alliance (3 at the championship).
+
+        size     -- number of robots that play for an alliance. Alliances with
+        more members play their strongest `size` robots.
+        """
+        self.model = model
+        self.captains = list(captains)
+        self.picks = picks
+        self.size = size
+
+        n = len(self.captains)
+        if n & (n - 1):
+            raise ValueError("The number of captains must be a power of two")
+
+        self.teams = np.array(list(teams))
+        if isinstance(model, TSModel):
+            i = team_positions(model.index, self.teams)
+            self.mu = model.mu[i]
+            self.var = model.sigma[i]**2 + model.env.beta**2
+            self.N = None
+        else:
+            i = team_positions(model.table.index, self.teams)
+            self.mu = model.table.Rating.to_numpy(dtype=np.float64)[i]
+            self.var = np.zeros(len(self.teams))
+            self.N = model.N
+
+        # bounds on alliance variance for optimistic probabilities
+        self.var_lo = 2 * size * self.var.min()
+        self.var_hi = 2 * size * self.var.max()
+
+        position = { t:i for i,t in enumerate(self.teams) }
+        self.seeds = [position[c] for c in self.captains]
+        pool = [i for i in range(len(self.teams)) if i not in set(self.seeds)]
+        self.pool = sorted(pool, key=lambda i: -self.mu[i])
+
+        # the order captains pick in, by seed index
+        self.turns = []
+        for r in range(picks):
+            seeds = list(range(n))
+            self.turns += seeds if r % 2 == 0 else seeds[::-1]
+
+        # the seed indices we might face in each round of the bracket
+        order = [s - 1 for s in bracket_order(n)]
+        self._blocks = {}
+        for seed in range(n):
+            at = order.index(seed)
+            blocks = []
+            width = 1
+            while width < n:
+                start = (at // width) ^ 1
+                blocks.append(order[start * width:(start + 1) * width])
+                width *= 2
+            self._blocks[seed] = blocks
+
+        self._ratings = {}
+
+
+    def playing(self, members) -> tuple:
+        """ Get the robots that play for an alliance: its `size` strongest members """
+        return tuple(sorted(sorted(members, key=lambda i: -self.mu[i])[:self.size]))
+
+
+    def rate_alliance(self, members):
+        """ Get the (cached) strength and variance of an alliance's best robots """
+        key = tuple(sorted(members))
+        try:
+            return self._ratings[key]
+        except KeyError:
+            best = list(self.playing(key))
+            rating = (self.mu[best].sum(), self.var[best].sum())
+            self._ratings[key] = rating
+            return rating
+
+
+    def P(self, a, b, bound=False) -> float:
+        """
+        Get the probability that alliance a beats alliance b. With bound=True,
+        use the most favorable variance so the result is an upper bound for
+        any alliances at least as strong as a and at most as strong as b.
+        """
+        mu_a, var_a = self.rate_alliance(a)
+        mu_b, var_b = self.rate_alliance(b)
+        d = mu_a - mu_b
+
+        if self.N is not None:
+            return 1.0 / (1 + 10**(-d / self.N))
+        if bound:
+            return ndtr(d / np.sqrt(self.var_lo if d > 0 else self.var_hi))
+        return ndtr(d / np.sqrt(var_a + var_b))
+
+
+    def objective(self, us, alliances, bound=False) -> float:
+        """
+        Get a lower bound on the probability that alliance `us` wins the
+        bracket, assuming it meets the toughest alliance it could face in
+        each round.
+        """
+        p = 1.0
+        for block in self._blocks[us]:
+            p *= min(series(self.P(alliances[us], alliances[b], bound)) for b in block)
+        return p
+
+
+    def _optimistic(self, us, t, remaining, alliances):
+        """
+        Fill in the rest of the draft as favorably as possible for `us`: we
+        take the best teams left and everyone else gets what remains after.
+        """
+        ours = sum(1 for s in self.turns[t:] if s == us)
+        alliances = [list(a) for a in alliances]
+        alliances[us] += remaining[:ours]
+
+        rest = iter(remaining[ours:])
+        for seed in self.turns[t:]:
+            if seed != us:
+                alliances[seed].append(next(rest))
+        return alliances
+
+
+    def simulate(self, alliances, n=100000, seed=None) -> pd.DataFrame:
+        """ Simulate the bracket between the robots that play for each alliance, in seed order """
+        lineups = [tuple(self.teams[list(self.playing(a))]) for a in alliances]
+        return simulate_bracket(self.model, lineups, n=n, seed=seed)
+
+
+    def optimize(self, us, top_k=5, n=100000, seed=None) -> pd.DataFrame:
+        """
+        Search for the picks that maximize our chance of winning the bracket.
+        Takes our captain's team number and returns the top_k alliances with
+        distinct playing robots. P(win) is simulated over n brackets against
+        the rest of the draft; P(win) bound is the lower bound the search
+        ranked them by.
+        """
+        us = self.captains.index(us)
+        best = []
+        counter = [0]
+
+        def push(value, alliances):
+            # the same robots can come out of different pick orders, or differ only in the backup
+            members = self.playing(alliances[us])
+            for i, (v, _, other) in enumerate(best):
+                if self.playing(other[us]) == members:
+                    if value <= v:
+                        return
+                    best.pop(i)
+                    heapq.heapify(best)
+                    break
+
+            item = (value, counter[0], [list(a) for a in alliances])
+            counter[0] += 1
+            if len(best) < top_k:
+                heapq.heappush(best, item)
+            elif value > best[0][0]:
+                heapq.heapreplace(best, item)
+
+        def search(t, remaining, alliances):
+            # other captains pick greedily until it's our turn
+            while t < len(self.turns) and self.turns[t] != us:
+                alliances[self.turns[t]].append(remaining[0])
+                remaining = remaining[1:]
+                t += 1
+
+            if t == len(self.turns):
+                push(self.objective(us, alliances), alliances)
+                return
+
+            if len(best) == top_k:
+                optimistic = self._optimistic(us, t, remaining, alliances)
+                if self.objective(us, optimistic, bound=True) <= best[0][0]:
+                    return
+
+            for j, team in enumerate(remaining):
+                alliances[us].append(team)
+                search(t + 1, remaining[:j] + remaining[j+1:], [list(a) for a in alliances])
+                alliances[us].pop()
+
+        search(0, list(self.pool), [[s] for s in self.seeds])
+
+        rows = []
+        for value, _, alliances in sorted(best, reverse=True):
+            field = [a for s,a in enumerate(alliances) if s != us]
+            rows.append({
+                'Picks': tuple(self.teams[alliances[us][1:]]),
+                'Alliance': tuple(self.teams[alliances[us]]),
+                'Rating': self.rate_alliance(alliances[us])[0],
+                'P(win)': self.simulate(alliances, n, seed).Winner.iloc[us],
+                'P(win) bound': value,
+                'P(match)': np.mean([self.P(alliances[us], a) for a in field]),
+            })
+
+        table = pd.DataFrame(rows)
+        return table.sort_values('P(win)', ascending=False).reset_index(drop=True)
@@ -1,22 +1,24 @@
-import pandas as pd
-import numpy as np
+import os
+from matchindex import MatchIndex
 
 teams = [254, 118]
 #teams = [236,1124]
 
-year = 2019
-for year in range(2001, 2020):
-    file = f"C:/Users/Sam/Documents/236/Statistics/data/{year}_MatchData_basic.csv"
-    data = pd.read_csv(file, index_col=False)
+DATA = "C:/Users/Sam/Documents/236/Statistics/data"
+INDEX = os.path.join(DATA, "match_index")
 
-    indices = [np.array(data.loc[data.Team==team, 'Key']) for team in teams]
+# build the index once, then every query reads it instead of the csvs
+if os.path.exists(INDEX):
+    index = MatchIndex.load(INDEX)
+else:
+    index = MatchIndex.from_files(range(2001, 2020), DATA)
+    index.save(INDEX)
 
-    a = np.array(indices)
+shared = index.matches(teams)
+for year, matches in shared.groupby('year'):
+    print(f"{year}: {matches.key.to_numpy()}")
 
-    if a.shape[0] == 2:
-        print(f"{year}: {np.intersect1d(a[0],a[1], assume_unique=True)}")
-    else:
-        print(f"{year}: {np.intersect1d(np.intersect1d(a[0],a[1]), a[2])}")
+if len(teams) == 2:
+    print(index.pair_counts(teams[0], teams[1]))
 
 print("Done")
-    
@@ -0,0 +1,295 @@
+"""
+Monte Carlo forecasts of event outcomes from a trained rating model.
+
+Outcomes of the matches left to play are sampled from the model's win
+probabilities thousands of times at once as array operations. Large runs can
+be split across a process pool.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from scipy.special import comb
+import pandas as pd
+import numpy as np
+
+ROUNDS = { 8: 'QF', 4: 'SF', 2: 'F', 1: 'Winner' }
+
+
+def win_probabilities(model, blue, red) -> np.ndarray:
+    """ Get the probability that blue wins each matchup under either model """
+    p = model.predict_many(blue, red)
+    if isinstance(p, tuple):
+        p = p[0]
+    return p
+
+
+def bracket_order(n):
+    """ Get the seeds of an n-alliance bracket in bracket order (1,8,4,5,2,7,3,6) """
+    order = [1]
+    while len(order) < n:
+        m = 2 * len(order)
+        order = [s for seed in order for s in (seed, m + 1 - seed)]
+    return order
+
+
+def series(p, best_of=3):
+    """ Get the probability of winning a best-of-n series from single match odds """
+    need = best_of // 2 + 1
+    return sum(comb(best_of, k) * p**k * (1 - p)**(best_of - k) for k in range(need, best_of + 1))
+
+
+def event_schedule(data, event) -> pd.DataFrame:
+    """
+    Get the qualification schedule for an event from a MatchData_ol frame.
+    Matches that haven't been played yet (scored -1 by TBA) are kept and
+    marked as unplayed.
+    """
+    df = data.loc[(data.Event == event) & (data['Competition Level'] == 'qm'), :].copy()
+    df.sort_values('Match Number', inplace=True)
+
+    schedule = pd.DataFrame({
+        'Key': df.Key,
+        'match': df['Match Number'],
+        'blue': list(zip(df.blue1, df.blue2, df.blue3)),
+        'red': list(zip(df.red1, df.red2, df.red3)),
+        'played': (df['blue score'] >= 0) & (df['red score'] >= 0),
+        'winner': df.winner.fillna('tie'),
+    })
+    schedule.reset_index(drop=True, inplace=True)
+
+    return schedule
+
+
+def _simulate_rankings(p, blue, red, base_rp, rp, n, seed):
+    """
+    Sample n outcomes of the unplayed matches and rank the teams in each.
+    Returns the summed ranking points and a teams x ranks count matrix.
+    """
+    rng = np.random.RandomState(seed)
+    n_teams = len(base_rp)
+
+    # alliance membership matrices for the unplayed matches (M x teams)
+    B = np.zeros((len(p), n_teams))
+    R = np.zeros((len(p), n_teams))
+    np.add.at(B, (np.arange(len(p))[:, None], blue), 1)
+    np.add.at(R, (np.arange(len(p))[:, None], red), 1)
+
+    blue_wins = (rng.random_sample((n, len(p))) < p).astype(np.float64)
+    points = base_rp + rp[0] * (blue_wins @ B + (1 - blue_wins) @ R) \
+        + rp[2] * ((1 - blue_wins) @ B + blue_wins @ R)
+
+    # break ties randomly
+    order = np.argsort(-(points + rng.random_sample(points.shape) * 1e-6), axis=1)
+    ranks = np.empty_like(order)
+    ranks[np.arange(n)[:, None], order] = np.arange(n_teams)
+
+    cells = np.tile(np.arange(n_teams), n) * n_teams + ranks.ravel()
+    counts = np.bincount(cells, minlength=n_teams * n_teams).reshape(n_teams, n_teams)
+
+    return points.sum(axis=0), counts
+
+
+def simulate_rankings(model, schedule, n=10000, rp=(2,1,0), processes=1, seed=None):
+    """
+    Forecast the final qualification rankings of an event.
+
+    Arguments:
+
+    model     -- a trained TSModel or EloModel.
+
+    schedule  -- the event's qualification schedule, as from `event_schedule`.
+    Played matches count with their real result, the rest are sampled.
+
+    rp        -- ranking points for a win, tie and loss.
+
+    processes -- number of worker processes to split the simulations across.
+
+    Returns a summary table with each team's expected ranking points and rank,
+    and a teams x ranks table of the probability of finishing at each rank.
+    """
+    teams = np.unique(np.array(schedule.blue.tolist() + schedule.red.tolist()))
+    position = pd.Index(teams)
+
+    blue = position.get_indexer(np.array(schedule.blue.tolist()).ravel()).reshape(-1, 3)
+    red = position.get_indexer(np.array(schedule.red.tolist()).ravel()).reshape(-1, 3)
+    played = schedule.played.to_numpy()
+
+    # ranking points already earned
+    earned = { 'blue': (rp[0], rp[2]), 'red': (rp[2], rp[0]), 'tie': (rp[1], rp[1]) }
+    base_rp = np.zeros(len(teams))
+    for b, r, winner in zip(blue[played], red[played], schedule.winner[played]):
+        base_rp[b] += earned[winner][0]
+        base_rp[r] += earned[winner][1]
+
+    p = win_probabilities(model, teams[blue[~played]], teams[red[~played]])
+    args = (p, blue[~played], red[~played], base_rp, rp)
+
+    seeds = np.random.RandomState(seed).randint(0, 2**31 - 1, size=max(processes, 1))
+    if processes > 1:
+        sizes = [len(c) for c in np.array_split(np.arange(n), processes)]
+        with ProcessPoolExecutor(processes) as pool:
+            results = list(pool.map(_simulate_rankings, *zip(*[args + (k, s) for k,s in zip(sizes, seeds)])))
+    else:
+        results = [_simulate_rankings(*args, n, seeds[0])]
+
+    points = sum(r[0] for r in results) / n
+    counts = sum(r[1] for r in results)
+
+    distribution = pd.DataFrame(counts / n, index=position, columns=np.arange(1, len(teams) + 1))
+    distribution.index.name = 'Team'
+
+    summary = pd.DataFrame({
+        'RP': points,
+        'Rank': distribution.to_numpy() @ np.arange(1, len(teams) + 1),
+        'P(1)': distribution[1],
+        'P(top 8)': distribution.loc[:, :8].sum(axis=1),
+    }, index=position)
+    summary.index.name = 'Team'
+    summary.sort_values('Rank', inplace=True)
+
+    return summary, distribution
+
+
+def event_alliances(data, event) -> list:
+    """
+    Recover an event's elimination alliances in seed order from the first
+    match of each quarterfinal in a MatchData_ol frame. The higher seed plays
+    on red, and quarterfinal sets 1-4 pit seeds 1v8, 4v5, 2v7 and 3v6.
+    """
+    df = data.loc[(data.Event == event) & (data['Competition Level'] == 'qf') & (data['Match Number'] == 1), :]
+    alliances = [None] * 8
+    for (_, row), seeds in zip(df.sort_values('Set Number').iterrows(), [(1,8), (4,5), (2,7), (3,6)]):
+        alliances[seeds[0] - 1] = (row.red1, row.red2, row.red3)
+        alliances[seeds[1] - 1] = (row.blue1, row.blue2, row.blue3)
+    return alliances
+
+
+def _series_matrix(model, alliances, best_of):
+    """ Get the probability that each alliance wins a series against each other """
+    k = len(alliances)
+    a, b = np.meshgrid(np.arange(k), np.arange(k), indexing='ij')
+    teams = np.array([list(t) for t in alliances])
+
+    p = win_probabilities(model, teams[a.ravel()], teams[b.ravel()]).reshape(k, k)
+    return series(p, best_of)
+
+
+def _bracket(S, alive, rng):
+    """
+    Play out a batch of brackets. `alive` holds the alliance indices of each
+    simulation in bracket order. Returns the survivors after every round.
+    """
+    rounds = []
+    while alive.shape[1] > 1:
+        a, b = alive[:, 0::2], alive[:, 1::2]
+        alive = np.where(rng.random_sample(a.shape) < S[a, b], a, b)
+        rounds.append(alive)
+    return rounds
+
+
+def _round_robin(S, alive, rng):
+    """ Play a round robin between the alliances of each simulation, then a final """
+    n, k = alive.shape
+    wins = np.zeros((n, k))
+    for i in range(k):
+        for j in range(i + 1, k):
+            won = rng.random_sample(n) < S[alive[:, i], alive[:, j]]
+            wins[:, i] += won
+            wins[:, j] += ~won
+
+    # the top two (ties broken randomly) meet in the final
+    top = np.argsort(-(wins + rng.random_sample(wins.shape) * 1e-6), axis=1)[:, :2]
+    finalists = np.take_along_axis(alive, top, axis=1)
+    return [finalists] + _bracket(S, finalists, rng)
+
+
+def _advancement(rounds, k, n):
+    """ Get the fraction of simulations in which each alliance survived each round """
+    return [np.bincount(r.ravel(), minlength=k) / n for r in rounds]
+
+
+def simulate_bracket(model, alliances, n=1000000, best_of=3, seed=None) -> pd.DataFrame:
+    """
+    Forecast an elimination bracket. Takes the alliances (the robots that will
+    play) in seed order, and returns each alliance's probability of reaching
+    each round and of winning.
+    """
+    k = len(alliances)
+    if k & (k - 1):
+        raise ValueError("The number of alliances must be a power of two")
+
+    S = _series_matrix(model, alliances, best_of)
+    rng = np.random.RandomState(seed)
+
+    start = np.broadcast_to(np.array(bracket_order(k)) - 1, (n, k))
+    rounds = _bracket(S, start, rng)
+
+    table = pd.DataFrame({ 'Alliance': list(alliances) }, index=pd.Index(np.arange(1, k+1), name='Seed'))
+    for r, p in zip(rounds, _advancement(rounds, k, n)):
+        table[ROUNDS.get(r.shape[1], f"Top {r.shape[1]}")] = p
+
+    return table
+
+
+def einstein_layout(year) -> str:
+    """ Get the format Einstein was played in for a given year """
+    year = int(year)
+    return 'round robin' if year == 2015 or year >= 2017 else 'bracket'
+
+
+def simulate_championship(model, divisions, layout='round robin', n=1000000, best_of=3, seed=None) -> pd.DataFrame:
+    """
+    Forecast a championship. Each division plays its own bracket and the
+    division winners meet on Einstein, either in a bracket (divisions are
+    paired in the order given) or in a round robin followed by a final.
+
+    Arguments:
+
+    divisions -- a dict of division name to its alliances in seed order.
+
+    layout    -- 'bracket' or 'round robin'; see `einstein_layout`.
+
+    Returns each alliance's probability of reaching each round of its
+    division, reaching Einstein and winning the championship.
+    """
+    names = list(divisions)
+    alliances = [a for d in names for a in divisions[d]]
+    sizes = [len(divisions[d]) for d in names]
+    offsets = np.cumsum([0] + sizes)
+    if any(size & (size - 1) for size in sizes):
+        raise ValueError("The number of alliances in each division must be a power of two")
+    if layout == 'bracket' and len(names) & (len(names) - 1):
+        raise ValueError("An Einstein bracket needs a power of two divisions; use layout='round robin'")
+
+    S = _series_matrix(model, alliances, best_of)
+    rng = np.random.RandomState(seed)
+    k = len(alliances)
+
+    columns = {}
+    winners = []
+    for d, size, offset in zip(names, sizes, offsets):
+        start = np.broadcast_to(np.array(bracket_order(size)) - 1 + offset, (n, size))
+        rounds = _bracket(S, start, rng)
+        for r, p in zip(rounds[:-1], _advancement(rounds[:-1], k, n)):
+            name = ROUNDS.get(r.shape[1], f"Top {r.shape[1]}")
+            columns.setdefault(name, np.zeros(k))
+            columns[name] += p
+        winners.append(rounds[-1])
+
+    einstein = np.concatenate(winners, axis=1)
+    if layout == 'bracket':
+        rounds = _bracket(S, einstein, rng)
+    else:
+        rounds = _round_robin(S, einstein, rng)
+
+    columns['Einstein'] = _advancement([einstein], k, n)[0]
+    for r, p in zip(rounds[:-1], _advancement(rounds[:-1], k, n)):
+        columns[f"Einstein {ROUNDS.get(r.shape[1], f'Top {r.shape[1]}')}"] = p
+    columns['Champion'] = _advancement(rounds[-1:], k, n)[0]
+
+    index = pd.MultiIndex.from_tuples([(d, s + 1) for d, size in zip(names, sizes) for s in range(size)],
+        names=['Division', 'Seed'])
+    table = pd.DataFrame({ 'Alliance': alliances }, index=index)
+    for name, p in columns.items():
+        table[name] = p
+
+    return table
@@ -0,0 +1,75 @@
+"""
+Directories of arrays, and caches.
+
+The histories, indexes and profiles built by the analysis modules are saved
+as a directory with one .npy file per array and a meta.json for everything
+else, so their arrays can be memory-mapped back rather than read whole.
+Anything built from the data files can be cached, and the cache reused
+until one of the files changes.
+
+Arrays indexed by team are looked up with `team_positions`.
+"""
+
+import pandas as pd
+import numpy as np
+import json
+import os
+
+META = "meta.json"
+
+
+def save_arrays(path, arrays:dict, meta:dict=None):
+    """
+    Write each array to <path>/<name>.npy and the metadata to
+    <path>/meta.json. Object arrays (e.g. of event keys) are stored as
+    strings, so they can be loaded without pickling.
+    """
+    os.makedirs(path, exist_ok=True)
+    for name, array in arrays.items():
+        array = np.asarray(array)
+        np.save(os.path.join(path, f"{name}.npy"), array.astype(str) if array.dtype == object else array)
+
+    with open(os.path.join(path, META), 'w') as f:
+        json.dump(meta or {}, f)
+
+
+def load_arrays(path, mmap_mode='r'):
+    """
+    Load a directory written by `save_arrays`, memory-mapping its arrays by
+    default. Returns a dict of the arrays by name, and the metadata.
+    """
+    with open(os.path.join(path, META), 'r') as f:
+        meta = json.load(f)
+
+    arrays = { os.path.splitext(name)[0]: np.load(os.path.join(path, name), mmap_mode=mmap_mode)
+        for name in sorted(os.listdir(path)) if name.endswith(".npy") }
+
+    return arrays, meta
+
+
+def is_fresh(cache, sources) -> bool:
+    """
+    Check that a cache exists and was written after every one of its source
+    files was last modified. The cache can be a file or a directory written
+    by `save_arrays`.
+    """
+    if cache is None:
+        return False
+    if os.path.isdir(cache):
+        cache = os.path.join(cache, META)
+    if not os.path.exists(cache):
+        return False
+    return os.path.getmtime(cache) >= max((os.path.getmtime(f) for f in sources), default=0)
+
+
+def team_positions(index:pd.Index, teams) -> np.ndarray:
+    """
+    Find the row of each team in a rating table. Accepts an array of team
+    numbers of any shape and returns an array of positions of the same shape.
+    """
+    teams = np.asarray(teams)
+    positions = index.get_indexer(teams.ravel())
+    if (positions < 0).any():
+        raise KeyError(f"Unknown teams: {np.unique(teams.ravel()[positions < 0])}")
+
+    return positions.reshape(teams.shape)
@@ -0,0 +1,50 @@
+import unittest
+import tempfile
+import os
+import numpy as np
+from evaluation import Evaluator
+
+
+class EvaluatorTest(unittest.TestCase):
+
+    def test_grows_for_late_weeks_and_years(self):
+        """ Offseason weeks past the week axis and seasons past the year axis are scored """
+        evaluator = Evaluator(keep_predictions=True)
+        evaluator.update(2017, 3, 'qm', 0.75, 'blue', key='2017a_qm1')
+        evaluator.update(2017, 22, 'qm', 0.25, 'blue', key='2017foc_qm1')
+        evaluator.update_many(2021, 30, ['qm', 'f'], [0.9, 0.4], ['blue', 'red'], key=['2021b_qm1', '2021b_f1m1'])
+
+        self.assertEqual(evaluator.weeks, 31)
+        self.assertIn(2021, evaluator.years)
+
+        summary = evaluator.summary(by=('year', 'week'))
+        self.assertEqual(summary.loc[(2017, 3), 'n'], 1)
+        self.assertAlmostEqual(summary.loc[(2017, 3), 'brier'], 0.0625)
+        self.assertAlmostEqual(summary.loc[(2017, 22), 'brier'], 0.5625)
+        self.assertEqual(summary.loc[(2021, 30), 'n'], 2)
+        self.assertAlmostEqual(summary.loc[(2021, 30), 'brier'], (0.01 + 0.16) / 2)
+        self.assertAlmostEqual(evaluator.brier(), (0.0625 + 0.5625 + 0.01 + 0.16) / 4)
+
+        with tempfile.TemporaryDirectory() as path:
+            filename = os.path.join(path, "evaluator.npz")
+            evaluator.save(filename)
+            loaded = Evaluator.load(filename)
+
+        loaded.update(2022, 1, 'qm', 0.5, 'tie')
+        self.assertEqual(loaded.n.sum(), 5)
+        np.testing.assert_array_equal(loaded.summary(by=('year',)).n.to_numpy(), [2, 2, 1])
+
+
+    def test_even_forecasts_count_half(self):
+        """ A 0.5 forecast picks no one, in both update and update_many """
+        single, batch = Evaluator(), Evaluator()
+        for p, winner in [(0.5, 'blue'), (0.5, 'red'), (0.8, 'blue'), (0.3, 'blue'), (0.5, 'tie')]:
+            single.update(2019, 1, 'qm', p, winner)
+        batch.update_many(2019, 1, ['qm'] * 5, [0.5, 0.5, 0.8, 0.3, 0.5], ['blue', 'red', 'blue', 'blue', 'tie'])
+
+        for evaluator in [single, batch]:
+            self.assertAlmostEqual(evaluator.summary().accuracy.iloc[0], 2 / 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+import tempfile
+import numpy as np
+import pandas as pd
+from history import RatingHistory
+
+
+class RatingHistoryTest(unittest.TestCase):
+
+    # (year, week) of each match, in training order, with a gap at 2018 week 2
+    WEEKS = [(2018, 1), (2018, 1), (2018, 3), (2018, 3), (2018, 4), (2019, 1), (2019, 2), (2019, 2)]
+
+    def setUp(self):
+        """ Train a toy model that adds one point to a team per match, keeping the true ratings after each match """
+        self.history = RatingHistory(['Rating'])
+        table = pd.DataFrame({ 'Rating': [0.0, 0.0, 0.0] }, index=pd.Index([1, 2, 3], name='Team'))
+
+        self.after = []
+        for m, (year, week) in enumerate(self.WEEKS):
+            self.history.advance(year, week, table)
+            table.loc[1 + m % 3, 'Rating'] += 1
+            self.after.append(table.Rating.copy())
+        self.history.close(table)
+
+
+    def expected(self, year, week) -> pd.Series:
+        """ The ratings after every match before the given week """
+        before = [m for m, w in enumerate(self.WEEKS) if w < (year, week)]
+        return self.after[before[-1]] if before else pd.Series(0.0, index=[1, 2, 3])
+
+
+    def check(self, history):
+        for year in [2017, 2018, 2019, 2020]:
+            for week in list(range(0, 6)) + [RatingHistory.CLOSE]:
+                expected = self.expected(year, week)
+                for team in [1, 2, 3]:
+                    self.assertEqual(history.as_of(team, year, week)[0], expected[team], (team, year, week))
+                np.testing.assert_array_equal(history.table(year, week).Rating.to_numpy(), expected.to_numpy())
+
+
+    def test_as_of(self):
+        self.check(self.history)
+
+
+    def test_season_close(self):
+        """ The last week of each season is recorded, including the last season """
+        final = self.after[-1]
+        for team in [1, 2, 3]:
+            self.assertEqual(self.history.as_of(team, 2019, RatingHistory.CLOSE)[0], final[team])
+            self.assertEqual(self.history.as_of(team, 2018, RatingHistory.CLOSE)[0], self.after[4][team])
+
+
+    def test_save_load(self):
+        with tempfile.TemporaryDirectory() as path:
+            self.history.save(path)
+            self.check(RatingHistory.load(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
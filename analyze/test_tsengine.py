@@ -0,0 +1,51 @@
+import unittest
+import numpy as np
+import trueskill as ts
+import tsengine
+
+
+class RateTest(unittest.TestCase):
+
+    def check(self, env, outcome):
+        """ Rate a batch of matches with tsengine and one at a time with trueskill, and compare """
+        rng = np.random.RandomState(0)
+        M = 20
+        mu = rng.normal(env.mu, 8, size=6 * M)
+        sigma = rng.uniform(1, env.sigma, size=6 * M)
+        positions = np.arange(6 * M).reshape(M, 6)
+        blue, red = positions[:, :3], positions[:, 3:]
+
+        expected_mu, expected_sigma = mu.copy(), sigma.copy()
+        for b, r in zip(blue, red):
+            ranks = [0, 0] if outcome == 0.5 else [0, 1] if outcome == 1.0 else [1, 0]
+            new_blue, new_red = env.rate([[env.create_rating(mu[i], sigma[i]) for i in b],
+                [env.create_rating(mu[i], sigma[i]) for i in r]], ranks=ranks)
+            for i, rating in zip(np.concatenate([b, r]), new_blue + new_red):
+                expected_mu[i], expected_sigma[i] = rating.mu, rating.sigma
+
+        tsengine.rate(mu, sigma, blue, red, np.full(M, outcome), env)
+        np.testing.assert_allclose(mu, expected_mu, rtol=0, atol=1e-9)
+        np.testing.assert_allclose(sigma, expected_sigma, rtol=0, atol=1e-9)
+
+
+    def test_outcomes(self):
+        """ Blue wins, red wins and ties, with and without a draw margin """
+        for draw_probability in [0.0, 0.1]:
+            env = ts.TrueSkill(draw_probability=draw_probability, backend='scipy')
+            for outcome in [1.0, 0.0, 0.5]:
+                if outcome == 0.5 and draw_probability == 0:
+                    continue
+                with self.subTest(draw_probability=draw_probability, outcome=outcome):
+                    self.check(env, outcome)
+
+
+    def test_draw_margin(self):
+        """ A draw margin wide enough that most matches fall inside it """
+        env = ts.TrueSkill(draw_probability=0.6, backend='scipy')
+        for outcome in [1.0, 0.0, 0.5]:
+            with self.subTest(outcome=outcome):
+                self.check(env, outcome)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -20,8 +20,9 @@ tba = tbapy.TBA(os.environ['TBA_API_KEY'])
 # ## Training the model
 # We can now train the model on a range of years. I've already built the
 # MatchData files for all the relevant years, so we can import them one by one
-# and train the model on the full year of data. To train on the full range of
-# data takes upwards of 20 minutes.
+# and train the model on the full year of data. `train_many` applies the
+# closed-form two-team update to whole waves of matches at once, so the full
+# range of data trains in seconds rather than the 20 minutes `train` takes.
 
 #%%
 # Multi-year simulation
@@ -32,20 +33,18 @@ model = TSModel(teams, env=models.ts.setup(mu=1000,sigma=100,beta=100,tau=10,dra
 print(f"Training on {','.join(map(str, years))}")
 print('='*35)
 start = time.time()
-winners = []
 
 for year in years:
     filename = f"../data/{year}_MatchData_ol.csv"
     data = pd.read_csv(filename)
     data = models.process_data(data)
     data = models.sort_data(data)
-    winners.append(data.winner)
 
     print(f"Year: {year}")
     print(f"Simulating {len(data)} matches")
     substart = time.time()
 
-    data.apply(model.train, axis=1)
+    model.train_many(data)
 
     print(f"Training time: {int(time.time() - substart)} s")
     print("=" * 35)
@@ -53,7 +52,8 @@ for year in years:
     #model.export(f"data/{year}_end_ratings.csv")
 
 print(f"Training time: {int(time.time() - start)} s")
-print(f"Brier score ovr: {model.test(pd.concat(winners))}")
+print(f"Brier score ovr: {model.test()}")
+print(model.evaluator.summary(by=('year','level')))
 
 model.rank()
 model.table.head(10)
@@ -82,12 +82,12 @@ print(f"Year: {YEAR}")
 print(f"Simulating {len(data)} matches")
 substart = time.time()
 
-data.apply(trainedmodel.train, axis=1)
+trainedmodel.train_many(data)
 
 print(f"Training time: {int(time.time() - substart)} s")
 print("=" * 35)
 
-print(f"Brier score: {trainedmodel.test(data.winner)}")
+print(f"Brier score: {trainedmodel.test()}")
 
 #%% [markdown]
 # We can also assess our model by looking at the distribution of skill across
@@ -111,8 +111,7 @@ plt.show()
 #%%
 # Plot with matplot
 filtered = model.table.loc[model.table.Score != 0]
-pairs = list(map(tuple, filtered.Rating))
-x,y = zip(*pairs)
+x,y = filtered.mu.to_numpy(), filtered.sigma.to_numpy()
 z = filtered.Score
 t = list(filtered.index)
 
@@ -202,3 +201,19 @@ ratings = pd.DataFrame(
 ratings['Score'] = ratings.Rating.apply(model.env.expose)
 ratings.sort_values('Score', ascending=False)
 ratings
+
+#%% [markdown]
+# At an event, the more useful question is who to pick. The optimizer searches
+# every pick order for a captain, assuming the other captains take the best
+# team left, and ranks the resulting alliances by their chance of winning the
+# elimination bracket.
+
+#%%
+# Optimize alliance selection
+from selection import AllianceOptimizer
+
+event_teams = [int(t[3:]) for t in tba.event_teams("2019cur", keys=True)]
+captains = [int(a['picks'][0][3:]) for a in tba.event_alliances("2019cur")]
+
+optimizer = AllianceOptimizer(model, event_teams, captains, picks=3)
+optimizer.optimize(captains[0], top_k=5)
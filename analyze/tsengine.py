@@ -0,0 +1,111 @@
+"""
+Closed-form TrueSkill updates for two-team matches.
+
+With only two teams in a match, TrueSkill's factor graph collapses to a single
+truncated Gaussian, so the update has an exact closed form. These functions
+apply it directly to arrays of mu and sigma, indexed by team position, and
+agree with `trueskill.TrueSkill.rate` up to the library's own approximations
+of the normal distribution.
+"""
+
+import numpy as np
+from scipy.special import ndtr, log_ndtr
+import math
+
+LOG_SQRT_2PI = 0.5 * math.log(2 * math.pi)
+
+
+def draw_margin(env, size=6) -> float:
+    """ Get the draw margin for a match between `size` players """
+    return env.ppf((env.draw_probability + 1) / 2.) * math.sqrt(size) * env.beta
+
+
+def _pdf_over_cdf(x):
+    """ Compute pdf(x) / cdf(x) without underflowing for very negative x """
+    return np.exp(-0.5 * x**2 - LOG_SQRT_2PI - log_ndtr(x))
+
+
+def win_factors(t, e):
+    """ Get the V and W multipliers for the winner of a decided match """
+    x = t - e
+    v = _pdf_over_cdf(x)
+    w = v * (v + x)
+    return v, w
+
+
+def draw_factors(t, e):
+    """ Get the V and W multipliers for a drawn match """
+    abs_t = np.abs(t)
+    a, b = e - abs_t, -e - abs_t
+    pdf_a = np.exp(-0.5 * a**2 - LOG_SQRT_2PI)
+    pdf_b = np.exp(-0.5 * b**2 - LOG_SQRT_2PI)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        denom = ndtr(a) - ndtr(b)
+        v = np.where(denom > 0, (pdf_b - pdf_a) / denom, a)
+        w = np.where(denom > 0, v**2 + (a * pdf_a - b * pdf_b) / denom, 0.0)
+
+    v = np.where(t < 0, -v, v)
+    return v, w
+
+
+def rate(mu, sigma, blue, red, outcome, env):
+    """
+    Update ratings in place for a batch of matches that share no teams.
+
+    Arguments:
+
+    mu, sigma -- float arrays of every team's rating, indexed by position.
+
+    blue, red -- Mx3 integer arrays of team positions for each alliance.
+
+    outcome   -- length M array, 1.0 if blue won, 0.0 if red won, 0.5 for a tie.
+    """
+    outcome = np.asarray(outcome, dtype=np.float64)
+    size = blue.shape[1] + red.shape[1]
+
+    # apply the dynamics factor before the match
+    var_b = sigma[blue]**2 + env.tau**2
+    var_r = sigma[red]**2 + env.tau**2
+    mu_b, mu_r = mu[blue], mu[red]
+
+    c2 = var_b.sum(axis=1) + var_r.sum(axis=1) + size * env.beta**2
+    c = np.sqrt(c2)
+    e = draw_margin(env, size) / c
+
+    # orient each match so that the winner (or blue, for ties) comes first
+    sign = np.where(outcome == 0.0, -1.0, 1.0)
+    t = sign * (mu_b.sum(axis=1) - mu_r.sum(axis=1)) / c
+
+    tie = outcome == 0.5
+    v, w = win_factors(t, e)
+    if tie.any():
+        v_d, w_d = draw_factors(t[tie], e[tie])
+        v[tie], w[tie] = v_d, w_d
+
+    step = (sign * v / c)[:, None]
+    shrink = (w / c2)[:, None]
+
+    mu[blue] = mu_b + var_b * step
+    mu[red] = mu_r - var_r * step
+    sigma[blue] = np.sqrt(var_b * np.maximum(1 - var_b * shrink, 0))
+    sigma[red] = np.sqrt(var_r * np.maximum(1 - var_r * shrink, 0))
+
+
+def schedule(blue, red) -> np.ndarray:
+    """
+    Split matches into waves that can be rated together. A match goes in the
+    wave after the last one any of its teams played in, so every team still
+    sees its matches in their original order and the result is identical to
+    rating the matches one at a time.
+    """
+    last = {}
+    waves = np.zeros(len(blue), dtype=np.int64)
+
+    for m, teams in enumerate(np.concatenate([blue, red], axis=1).tolist()):
+        wave = max(last.get(t, -1) for t in teams) + 1
+        waves[m] = wave
+        for t in teams:
+            last[t] = wave
+
+    return waves